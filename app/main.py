@@ -1,42 +1,92 @@
 import os
+import shutil
 import uuid
 from pathlib import Path
 import json
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional
 
-from fastapi import BackgroundTasks, FastAPI, Request, UploadFile, File, Form
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request, Response, UploadFile, File, Form, Query
+from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-from app.services.transcribe import transcribe_audio
-from app.services.summarize import summarize_text
-BASE_DIR = Path(__file__).resolve().parent.parent
-UPLOAD_DIR = BASE_DIR / "uploads"
-DATA_DIR = BASE_DIR / "data"
+from app.services.transcribe import (
+    draft_model_size,
+    foreground_task,
+    transcribe_audio,
+    upgrade_model_size,
+    wait_for_foreground,
+)
+from app.services.summarize import SUMMARIZE_TIMEOUT, summarize_text_with_timeout
+from app.services.leases import LeaseManager
+from app.services.storage import (
+    BASE_DIR,
+    UPLOAD_DIR,
+    audio_url,
+    content_dir,
+    data_file,
+    delete_record_files,
+    find_audio,
+    is_valid_rid,
+    iter_rids,
+    new_audio_path,
+    new_generation,
+    publish_generation,
+    read_meta,
+    update_meta,
+    write_text_atomic,
+)
 TEMPLATES_DIR = BASE_DIR / "templates"
 STATIC_DIR = BASE_DIR / "static"
 
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-DATA_DIR.mkdir(parents=True, exist_ok=True)
-
 app = FastAPI(title="Audio Diary - 上传、转写与总结")
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
 templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 
+# 任务执行方式：local = 本进程后台任务；remote = 放入租约队列，由独立 worker 进程领取（python -m app.worker）
+TASK_BACKEND = os.getenv("TASK_BACKEND", "local")
+# worker 接口的共享口令，通过请求头 X-Worker-Token 传递；未设置时 worker 接口一律拒绝
+WORKER_TOKEN = os.getenv("WORKER_TOKEN", "")
+
+lease_manager = LeaseManager(
+    default_ttl=int(os.getenv("WORKER_LEASE_TTL", "120")),
+    max_attempts=int(os.getenv("WORKER_MAX_ATTEMPTS", "3")),
+)
+
+# 搜索分页的最大偏移：Chroma 不支持 offset，翻到第 N 条需要取回前 N 条，代价随 offset 线性增长
+SEARCH_MAX_OFFSET = int(os.getenv("SEARCH_MAX_OFFSET", "1000"))
+
+# 两遍转写：前台任务用草稿模型，设置 WHISPER_UPGRADE_MODEL 后在空闲时用大模型后台升级
+_upgrade_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="transcript-upgrade")
+_upgrade_pending: set = set()
+
+# 每条记录一把锁：本进程内写转写/总结的任务（前台任务、升级替换、手动编辑总结）互斥
+_record_locks: Dict[str, threading.Lock] = {}
+_record_locks_guard = threading.Lock()
+
+
+def _record_lock(rid: str) -> threading.Lock:
+    with _record_locks_guard:
+        return _record_locks.setdefault(rid, threading.Lock())
+
 
 def normalize_rid(rid: str) -> str:
     # 避免某些客户端/脚本拼接时把分号等带进路径参数
-    return rid.strip().strip(";")
+    rid = rid.strip().strip(";")
+    # rid 会拼进文件路径，非法值（如 `..`）直接按记录不存在处理
+    if not is_valid_rid(rid):
+        raise HTTPException(status_code=404, detail="记录不存在")
+    return rid
 
 
 
 def _status_path(rid: str) -> Path:
     rid = normalize_rid(rid)
-    return DATA_DIR / f"{rid}.status.json"
+    return data_file(rid, ".status.json")
 
 
 def read_status(rid: str) -> Dict[str, Any]:
@@ -69,8 +119,29 @@ def write_status(
         "error": error,
         "started_at": started_at,
         "updated_at": now,
+        # 纳秒时间戳：同一秒内的多次写入也能区分，用于判断状态是否被其他任务改写过
+        "updated_ns": time.time_ns(),
     }
-    _status_path(rid).write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    p = _status_path(rid)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    return payload
+
+
+def _sync_index_state(rid: str, state: str):
+    # 搜索可按任务状态过滤：每次状态变化都同步到索引元数据（记录未入库时忽略）。
+    # 只在后台线程/后台任务中调用，不放进 write_status，避免在事件循环中访问向量库
+    try:
+        from app.services.vector_store import update_document_state
+        update_document_state(rid, state)
+    except Exception:
+        pass
+
+
+def _set_state(rid: str, state: str, **fields: Any) -> Dict[str, Any]:
+    """后台线程中更新任务状态并同步到索引（请求处理中改用 write_status + 后台任务同步）"""
+    payload = write_status(rid, state, **fields)
+    _sync_index_state(rid, state)
     return payload
 
 
@@ -78,21 +149,17 @@ def list_records() -> List[dict]:
     records: List[Dict[str, Any]] = []
 
     # 先收集原始数据
-    for item in UPLOAD_DIR.iterdir():
-        if not item.is_file():
-            continue
-
-        # 忽略转写预处理产生的临时文件（历史遗留）
-        if item.name.endswith('.proc.wav'):
+    for rid in iter_rids():
+        item = find_audio(rid)
+        if not item:
             continue
 
-        rid = item.stem
-        transcript_file = DATA_DIR / f"{rid}.txt"
-        summary_file = DATA_DIR / f"{rid}.summary.txt"
+        transcript_file = data_file(rid, ".txt")
+        summary_file = data_file(rid, ".summary.txt")
         st = read_status(rid)
 
         # 读取 meta（兼容旧数据）
-        meta_path = DATA_DIR / f"{rid}.meta.json"
+        meta_path = data_file(rid, ".meta.json")
         original_filename = item.name
         created_at = int(item.stat().st_mtime)
         if meta_path.exists():
@@ -110,7 +177,7 @@ def list_records() -> List[dict]:
             "created_at_str": created_at_str,
             "original_filename": original_filename,
             "filename": item.name,  # 实际存储文件名（rid.ext）
-            "audio_url": f"/uploads/{item.name}",
+            "audio_url": audio_url(item),
             "has_transcript": transcript_file.exists(),
             "has_summary": summary_file.exists(),
             "task_state": st.get("state", "idle"),
@@ -137,22 +204,60 @@ async def index(request: Request):
 
 
 @app.get("/search", response_class=HTMLResponse)
-async def search_page(request: Request, q: Optional[str] = None):
-    """搜索页面：展示搜索框和结果"""
+async def search_page(
+    request: Request,
+    q: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    filename: Optional[str] = None,
+    state: Optional[str] = None,
+    offset: int = 0,
+    limit: int = 20,
+):
+    """搜索页面：展示搜索框和结果；日期范围、文件名、任务状态作为过滤条件下推到向量库"""
     results = []
     show_results = False
+    has_next = False
+    offset = max(offset, 0)
+    limit = min(max(limit, 1), 100)
+    if offset > SEARCH_MAX_OFFSET:
+        return HTMLResponse(f"offset 不能超过 {SEARCH_MAX_OFFSET}，请缩小搜索范围", status_code=400)
     
+    from app.services.export import parse_date
+
+    try:
+        created_from = parse_date(start)
+        created_to = parse_date(end, end_of_day=True)
+    except ValueError:
+        return HTMLResponse("日期格式应为 YYYY-MM-DD", status_code=400)
+
     if q and q.strip():
         show_results = True
         try:
-            from app.services.vector_store import search_documents
-            results = search_documents(q, n_results=20)
+            from app.services.vector_store import build_where, search_documents
+            where = build_where(
+                created_from=created_from,
+                created_to=created_to,
+                original_filename=(filename or "").strip() or None,
+                state=state or None,
+            )
+            # 多取一条用于判断是否有下一页
+            results = search_documents(q, n_results=limit + 1, offset=offset, where=where)
+            has_next = len(results) > limit and offset + limit <= SEARCH_MAX_OFFSET
+            results = results[:limit]
         except Exception:
             pass
     
     return templates.TemplateResponse("search.html", {
         "request": request,
         "query": q or "",
+        "start": start or "",
+        "end": end or "",
+        "filename": filename or "",
+        "state": state or "",
+        "offset": offset,
+        "limit": limit,
+        "has_next": has_next,
         "results": results,
         "show_results": show_results,
     })
@@ -161,18 +266,20 @@ async def search_page(request: Request, q: Optional[str] = None):
 @app.get("/detail/{rid}", response_class=HTMLResponse)
 async def detail(request: Request, rid: str):
     rid = normalize_rid(rid)
-    audio_file = next((p for p in UPLOAD_DIR.glob(f"{rid}.*")), None)
+    audio_file = find_audio(rid)
     if not audio_file:
         return HTMLResponse("记录不存在", status_code=404)
-    transcript_file = DATA_DIR / f"{rid}.txt"
-    summary_file = DATA_DIR / f"{rid}.summary.txt"
+    # 转写与总结取自同一代，升级切换时不会看到新转写配旧总结
+    content = content_dir(rid)
+    transcript_file = data_file(rid, ".txt", content)
+    summary_file = data_file(rid, ".summary.txt", content)
     transcript = transcript_file.read_text(encoding="utf-8") if transcript_file.exists() else ""
     summary = summary_file.read_text(encoding="utf-8") if summary_file.exists() else ""
     return templates.TemplateResponse("detail.html", {
         "request": request,
         "rid": rid,
         "filename": audio_file.name,
-        "audio_url": f"/uploads/{audio_file.name}",
+        "audio_url": audio_url(audio_file),
         "transcript": transcript,
         "summary": summary,
         "status": read_status(rid),
@@ -186,11 +293,12 @@ async def upload_audio(request: Request, background_tasks: BackgroundTasks, file
         return HTMLResponse("仅支持音频文件: wav/mp3/m4a/aac/flac/ogg", status_code=400)
 
     rid = uuid.uuid4().hex
-    target = UPLOAD_DIR / f"{rid}{suffix}"
+    target = new_audio_path(rid, suffix)
 
     try:
+        # 分块写入磁盘，避免大文件整体读入内存
         with open(target, "wb") as f:
-            f.write(await file.read())
+            shutil.copyfileobj(file.file, f, 1024 * 1024)
 
         # 保存元信息（用户原始文件名、创建时间）
         meta = {
@@ -198,17 +306,17 @@ async def upload_audio(request: Request, background_tasks: BackgroundTasks, file
             "original_filename": Path(file.filename).name,
             "created_at": int(time.time()),
         }
-        (DATA_DIR / f"{rid}.meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+        data_file(rid, ".meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
 
         # 写入 queued 并投递后台任务（转写 + 总结）
         write_status(rid, "queued", mode="all", message="queued")
-        background_tasks.add_task(_run_task, rid, "all")
+        _dispatch_task(rid, "all", background_tasks)
 
         # 立即跳转到详情页（由前端轮询状态）
         return RedirectResponse(url=f"/detail/{rid}", status_code=303)
     except Exception as e:
         # 上传保存阶段失败，写 error 文件并返回错误页
-        (DATA_DIR / f"{rid}.error.txt").write_text(str(e), encoding="utf-8")
+        data_file(rid, ".error.txt").write_text(str(e), encoding="utf-8")
         write_status(rid, "error", mode="all", error=str(e), message="upload failed")
         return templates.TemplateResponse(
             "error.html",
@@ -226,11 +334,11 @@ async def upload_audio(request: Request, background_tasks: BackgroundTasks, file
 @app.get("/detail/{rid}/summary/edit", response_class=HTMLResponse)
 async def edit_summary(request: Request, rid: str):
     rid = normalize_rid(rid)
-    audio_file = next((p for p in UPLOAD_DIR.glob(f"{rid}.*")), None)
+    audio_file = find_audio(rid)
     if not audio_file:
         return HTMLResponse("记录不存在", status_code=404)
     
-    summary_file = DATA_DIR / f"{rid}.summary.txt"
+    summary_file = data_file(rid, ".summary.txt")
     summary = summary_file.read_text(encoding="utf-8") if summary_file.exists() else ""
     
     return templates.TemplateResponse("summary_edit.html", {
@@ -242,14 +350,23 @@ async def edit_summary(request: Request, rid: str):
 
 
 @app.post("/detail/{rid}/summary/save")
-async def update_summary(rid: str, summary: Optional[str] = Form(None)):
+def update_summary(rid: str, summary: Optional[str] = Form(None)):
+    # 同步函数：在线程池中执行，等待记录锁时不阻塞事件循环
     rid = normalize_rid(rid)
     # 校验记录存在（至少音频文件存在）
-    audio_file = next((p for p in UPLOAD_DIR.glob(f"{rid}.*")), None)
+    audio_file = find_audio(rid)
     if not audio_file:
         return HTMLResponse("记录不存在", status_code=404)
 
-    (DATA_DIR / f"{rid}.summary.txt").write_text(summary or "", encoding="utf-8")
+    lock = _record_lock(rid)
+    if not lock.acquire(timeout=10):
+        return HTMLResponse("记录正在处理中，请稍后再试", status_code=409)
+    try:
+        data_file(rid, ".summary.txt").write_text(summary or "", encoding="utf-8")
+        # 记录编辑时间；后台升级转写时不会覆盖手动编辑过的总结
+        update_meta(rid, summary_edited_at=int(time.time()))
+    finally:
+        lock.release()
     return RedirectResponse(url=f"/detail/{rid}", status_code=303)
 
 
@@ -264,26 +381,50 @@ async def delete_record(rid: str):
     except Exception:
         pass
     
-    # 删除上传音频
-    removed = False
-    for p in UPLOAD_DIR.glob(f"{rid}.*"):
-        try:
-            p.unlink()
-            removed = True
-        except Exception:
-            pass
-    # 删除转写与总结与错误文件
-    for suffix in [".txt", ".summary.txt", ".error.txt"]:
-        f = DATA_DIR / f"{rid}{suffix}"
-        if f.exists():
-            try:
-                f.unlink()
-            except Exception:
-                pass
+    # 删除音频目录与数据目录（转写、总结、元信息、状态、错误文件）
+    delete_record_files(rid)
     # 重定向回首页
     return RedirectResponse(url="/", status_code=303)
 
 
+@app.get("/export/{rid}.md")
+async def export_markdown(rid: str):
+    """导出单条记录为 Markdown（总结 + 转写 + 元信息）"""
+    from app.services.export import markdown_path
+
+    rid = normalize_rid(rid)
+    audio_file = find_audio(rid)
+    if not audio_file:
+        return HTMLResponse("记录不存在", status_code=404)
+    filename = Path(read_meta(rid).get("original_filename") or audio_file.name).stem + ".md"
+    return FileResponse(str(markdown_path(rid)), media_type="text/markdown; charset=utf-8", filename=filename)
+
+
+@app.get("/export.zip")
+async def export_zip(
+    rid: Optional[List[str]] = Query(None),
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    audio: bool = False,
+):
+    """批量导出为 ZIP（流式生成）：可指定多个 rid，或按创建日期范围 start/end（YYYY-MM-DD）筛选"""
+    from app.services.export import parse_date, select_rids, stream_zip
+
+    try:
+        start_ts = parse_date(start)
+        end_ts = parse_date(end, end_of_day=True)
+    except ValueError:
+        return HTMLResponse("日期格式应为 YYYY-MM-DD", status_code=400)
+
+    rids = select_rids([normalize_rid(r) for r in rid] if rid else None, start_ts, end_ts)
+    filename = f"audio-diary-{time.strftime('%Y%m%d-%H%M%S')}.zip"
+    return StreamingResponse(
+        stream_zip(rids, include_audio=audio),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 # Expose uploads statically
 app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
 
@@ -294,70 +435,180 @@ async def status(rid: str):
 
 
 def _run_task(rid: str, mode: str):
+    rid = normalize_rid(rid)
+    with _record_lock(rid), foreground_task():
+        _run_task_inner(rid, mode)
+    if mode in ("transcribe", "all") and read_meta(rid).get("transcript_tier") == "draft":
+        _schedule_upgrade(rid)
+
+
+def _run_task_inner(rid: str, mode: str):
     rid = normalize_rid(rid)
     # mode: transcribe | summarize | all
-    audio_file = next((p for p in UPLOAD_DIR.glob(f"{rid}.*")), None)
+    audio_file = find_audio(rid)
     if not audio_file:
-        write_status(rid, "error", mode=mode, error="record_not_found")
+        _set_state(rid, "error", mode=mode, error="record_not_found")
         return
 
     started_at = int(time.time())
     try:
-        write_status(rid, "running", mode=mode, started_at=started_at, message="task started")
+        _set_state(rid, "running", mode=mode, started_at=started_at, message="task started")
 
-        transcript_file = DATA_DIR / f"{rid}.txt"
-        summary_file = DATA_DIR / f"{rid}.summary.txt"
+        transcript_file = data_file(rid, ".txt")
+        summary_file = data_file(rid, ".summary.txt")
 
         transcript: str = transcript_file.read_text(encoding="utf-8") if transcript_file.exists() else ""
 
         if mode in ("transcribe", "all"):
-            write_status(rid, "transcribing", mode=mode, started_at=started_at, message="transcribing")
+            _set_state(rid, "transcribing", mode=mode, started_at=started_at, message="transcribing")
             transcript = transcribe_audio(str(audio_file))
             transcript_file.write_text(transcript, encoding="utf-8")
+            update_meta(
+                rid,
+                transcript_model=draft_model_size(),
+                transcript_tier="draft" if upgrade_model_size() else None,
+            )
 
         if mode in ("summarize", "all"):
-            write_status(rid, "summarizing", mode=mode, started_at=started_at, message="summarizing (timeout=180s)")
+            _set_state(rid, "summarizing", mode=mode, started_at=started_at, message=f"summarizing (timeout={SUMMARIZE_TIMEOUT}s)")
 
             # 对 summarize 增加超时保护，避免任务卡死
-            with ThreadPoolExecutor(max_workers=1) as ex:
-                fut = ex.submit(summarize_text, transcript)
-                try:
-                    summary = fut.result(timeout=180)
-                except FuturesTimeoutError:
-                    write_status(
-                        rid,
-                        "error",
-                        mode=mode,
-                        started_at=started_at,
-                        error="summarize_timeout",
-                        message="summarize timeout (180s)",
-                    )
-                    return
+            try:
+                summary = summarize_text_with_timeout(transcript)
+            except TimeoutError:
+                _set_state(
+                    rid,
+                    "error",
+                    mode=mode,
+                    started_at=started_at,
+                    error="summarize_timeout",
+                    message=f"summarize timeout ({SUMMARIZE_TIMEOUT}s)",
+                )
+                return
 
             summary_file.write_text(summary, encoding="utf-8")
+            update_meta(rid, summary_edited_at=None)
 
         # 更新向量索引（优先使用总结，其次使用转写文本）
-        try:
-            from app.services.vector_store import add_document
-            # 读取元数据
-            meta_path = DATA_DIR / f"{rid}.meta.json"
-            metadata = {}
-            if meta_path.exists():
-                try:
-                    metadata = json.loads(meta_path.read_text(encoding="utf-8"))
-                except Exception:
-                    pass
-            
-            # 使用总结或转写文本建立索引
-            index_text = summary if mode in ("summarize", "all") and summary else transcript
-            if index_text:
-                add_document(rid, index_text, metadata)
-        except Exception:
-            pass  # 索引更新失败不影响主流程
+        _index_record(rid, summary if mode in ("summarize", "all") and summary else transcript)
+
+        _set_state(rid, "done", mode=mode, started_at=started_at, message="done")
+    except Exception as e:
+        _set_state(rid, "error", mode=mode, started_at=started_at, error=str(e), message="error")
+
+
+def _index_record(rid: str, index_text: str):
+    try:
+        from app.services.vector_store import add_document
+        # 读取元数据；建索引发生在任务完成时，状态记为 done
+        metadata = read_meta(rid)
+        metadata["state"] = "done"
+
+        # 使用总结或转写文本建立索引
+        if index_text:
+            add_document(rid, index_text, metadata)
+    except Exception:
+        pass  # 索引更新失败不影响主流程
+
+
+def _schedule_upgrade(rid: str):
+    if not upgrade_model_size() or rid in _upgrade_pending:
+        return
+    _upgrade_pending.add(rid)
+    _upgrade_executor.submit(_upgrade_transcript, rid)
+
+
+def _upgrade_transcript(rid: str):
+    """
+    用较大模型重新转写，期间记录被重跑/删除/编辑则放弃结果
 
-        write_status(rid, "done", mode=mode, started_at=started_at, message="done")
+    新结果在锁外生成；替换时持有记录锁（与 _run_task、编辑总结互斥），把转写、总结、元信息
+    写成新一代后一次性切换（见 storage.publish_generation），再在同一把锁内更新索引。
+    """
+    model_size = upgrade_model_size()
+    try:
+        # 低优先级：有前台任务（页面任务或批量导入）时暂停，转写过程中也会让出
+        wait_for_foreground()
+
+        audio_file = find_audio(rid)
+        before = read_status(rid)
+        if not audio_file or before.get("state") != "done" or read_meta(rid).get("transcript_tier") != "draft":
+            return
+
+        transcript = transcribe_audio(str(audio_file), model_size=model_size, low_priority=True)
+        summary: Optional[str] = None
+        if not read_meta(rid).get("summary_edited_at"):
+            wait_for_foreground()
+            try:
+                summary = summarize_text_with_timeout(transcript)
+            except TimeoutError:
+                summary = None  # 总结超时则保留草稿总结
+
+        with _record_lock(rid):
+            if not find_audio(rid) or read_status(rid) != before:
+                return
+            current = content_dir(rid)
+            meta = read_meta(rid, current)
+            if meta.get("transcript_tier") != "draft":
+                return
+
+            # 新一代：转写、总结（手动编辑过或新总结失败时沿用当前的）、元信息
+            gen = new_generation(rid)
+            write_text_atomic(data_file(rid, ".txt", gen), transcript)
+            old_summary_file = data_file(rid, ".summary.txt", current)
+            if not summary or meta.get("summary_edited_at"):
+                summary = old_summary_file.read_text(encoding="utf-8") if old_summary_file.exists() else None
+            if summary is not None:
+                write_text_atomic(data_file(rid, ".summary.txt", gen), summary)
+            meta.update(transcript_model=model_size, transcript_tier="final")
+            meta.pop("transcript_upgrade_error", None)
+            write_text_atomic(data_file(rid, ".meta.json", gen), json.dumps(meta, ensure_ascii=False, indent=2))
+
+            # 不持锁的写入方（重跑入队、worker、批量导入）会先改状态文件：状态已变说明记录已被接管，
+            # 由其后续任务重新生成结果，丢弃新一代。比较整个状态（含 updated_ns），
+            # 同一秒内 done → queued 的改写也能识别
+            if read_status(rid) != before:
+                shutil.rmtree(gen, ignore_errors=True)
+                return
+            publish_generation(rid, gen)
+            _index_record(rid, summary or transcript)
+            write_status(
+                rid,
+                "done",
+                mode=before.get("mode"),
+                started_at=before.get("started_at"),
+                message=f"transcript upgraded ({model_size})",
+            )
     except Exception as e:
-        write_status(rid, "error", mode=mode, started_at=started_at, error=str(e), message="error")
+        # 升级失败不影响已发布的草稿
+        update_meta(rid, transcript_upgrade_error=str(e))
+    finally:
+        _upgrade_pending.discard(rid)
+
+
+def _schedule_upgrade_if_draft(rid: str):
+    if not upgrade_model_size() or TASK_BACKEND == "remote":
+        return
+    if read_meta(rid).get("transcript_tier") == "draft":
+        _schedule_upgrade(rid)
+
+
+@app.on_event("startup")
+def _resume_upgrades():
+    """服务重启后，继续升级仍是草稿的转写（包括命令行批量导入的记录）"""
+    if not upgrade_model_size() or TASK_BACKEND == "remote":
+        return
+    for rid in iter_rids():
+        _schedule_upgrade_if_draft(rid)
+
+
+def _dispatch_task(rid: str, mode: str, background_tasks: BackgroundTasks):
+    """按 TASK_BACKEND 投递任务：本进程后台执行，或放入租约队列等待 worker 领取"""
+    background_tasks.add_task(_sync_index_state, rid, "queued")
+    if TASK_BACKEND == "remote":
+        lease_manager.enqueue(rid, mode)
+    else:
+        background_tasks.add_task(_run_task, rid, mode)
 
 
 @app.post("/tasks/{rid}/rerun")
@@ -368,7 +619,7 @@ async def rerun_task(rid: str, background_tasks: BackgroundTasks, mode: str = Fo
 
     # 立即写入 queued 并投递后台任务
     write_status(rid, "queued", mode=mode, message="queued")
-    background_tasks.add_task(_run_task, rid, mode)
+    _dispatch_task(rid, mode, background_tasks)
 
     # 立刻回详情页，前端轮询 status
     return RedirectResponse(url=f"/detail/{rid}", status_code=303)
@@ -384,7 +635,248 @@ async def rebuild_index_endpoint():
     """管理接口：重建向量索引"""
     try:
         from app.services.vector_store import rebuild_index
-        stats = rebuild_index(DATA_DIR, UPLOAD_DIR)
+        stats = rebuild_index()
+        return JSONResponse({"status": "success", "stats": stats})
+    except Exception as e:
+        return JSONResponse({"status": "error", "error": str(e)}, status_code=500)
+
+
+@app.on_event("startup")
+def _start_gc():
+    from app.services.gc import start_gc_scheduler
+
+    # 上次压缩在替换集合时中断：接管残留的副本，避免数据停留在 __compact 中
+    try:
+        from app.services.vector_store import recover_compaction
+        result = recover_compaction()
+        if result:
+            print(f"[gc] leftover compaction collection {result}", flush=True)
+    except Exception as e:
+        print(f"[gc] compaction recovery failed: {e}", flush=True)
+
+    start_gc_scheduler()
+
+
+@app.post("/admin/gc")
+def gc_endpoint(dry_run: bool = False):
+    """管理接口：立即执行一次存储垃圾回收（含向量集合压缩）"""
+    # 同步函数：全量扫描与压缩在线程池中执行，不阻塞事件循环
+    try:
+        from app.services.gc import collect_garbage
+        stats = collect_garbage(dry_run=dry_run)
         return JSONResponse({"status": "success", "stats": stats})
     except Exception as e:
         return JSONResponse({"status": "error", "error": str(e)}, status_code=500)
+
+
+@app.post("/admin/import")
+async def import_directory(background_tasks: BackgroundTasks, src_dir: str = Form(...)):
+    """管理接口：批量导入服务器本地目录中的音频（后台执行，可重复调用以断点续传）"""
+    from app.services.bulk_import import is_import_running, run_import
+
+    src = Path(src_dir).expanduser()
+    if not src.is_dir():
+        return JSONResponse({"status": "error", "error": f"not a directory: {src_dir}"}, status_code=400)
+    if is_import_running(src):
+        return JSONResponse({"status": "error", "error": f"import already running: {src.resolve()}"}, status_code=409)
+    # 服务进程内导入：每条记录完成后立即安排草稿转写升级，无需等到重启
+    background_tasks.add_task(run_import, src, write_status, _schedule_upgrade_if_draft)
+    return JSONResponse({"status": "accepted", "src_dir": str(src.resolve())}, status_code=202)
+
+
+@app.get("/admin/import/status")
+async def import_status(src_dir: str):
+    """管理接口：查看某个目录的导入进度（基于 checkpoint）"""
+    from app.services.bulk_import import read_checkpoint, summarize_checkpoint
+
+    checkpoint = read_checkpoint(Path(src_dir).expanduser())
+    return JSONResponse({
+        "src_dir": checkpoint.get("src_dir"),
+        "updated_at": checkpoint.get("updated_at"),
+        "stats": summarize_checkpoint(checkpoint),
+    })
+
+
+# ---- worker 租约接口（TASK_BACKEND=remote 时使用） ----
+
+@app.on_event("startup")
+def _requeue_pending_tasks():
+    """服务重启后租约丢失：把未完成的任务按 status.json 重新入队"""
+    if TASK_BACKEND != "remote":
+        return
+    if not WORKER_TOKEN:
+        print("[worker] TASK_BACKEND=remote but WORKER_TOKEN is not set: worker endpoints are disabled", flush=True)
+    for rid in iter_rids():
+        st = read_status(rid)
+        if st.get("state") in ("queued", "running", "transcribing", "summarizing"):
+            mode = st.get("mode") or "all"
+            _set_state(rid, "queued", mode=mode, message="requeued after restart")
+            lease_manager.enqueue(rid, mode)
+
+
+def _check_worker_token(request: Request) -> Optional[JSONResponse]:
+    # 未配置口令时不开放 worker 接口，否则网络上任何人都能领取任务、提交任意转写
+    if not WORKER_TOKEN:
+        return JSONResponse({"error": "WORKER_TOKEN not configured"}, status_code=503)
+    if request.headers.get("X-Worker-Token") != WORKER_TOKEN:
+        return JSONResponse({"error": "invalid worker token"}, status_code=401)
+    return None
+
+
+def _handle_expired_leases(expired, background_tasks: BackgroundTasks) -> None:
+    for lease in expired:
+        if lease.attempts >= lease_manager.max_attempts:
+            write_status(lease.rid, "error", mode=lease.mode, error="lease_expired",
+                         message=f"lease expired {lease.attempts} times (last worker: {lease.worker_id})")
+            background_tasks.add_task(_sync_index_state, lease.rid, "error")
+        else:
+            write_status(lease.rid, "queued", mode=lease.mode, message=f"lease expired, requeued (worker: {lease.worker_id})")
+            background_tasks.add_task(_sync_index_state, lease.rid, "queued")
+
+
+def _lease_payload(lease) -> Dict[str, Any]:
+    return {
+        "lease_id": lease.lease_id,
+        "rid": lease.rid,
+        "mode": lease.mode,
+        "expires_at": int(lease.expires_at),
+    }
+
+
+@app.post("/worker/lease")
+async def worker_claim(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    worker_id: str = Form(...),
+    ttl: Optional[int] = Form(None),
+):
+    """worker 领取任务；队列为空时返回 204"""
+    denied = _check_worker_token(request)
+    if denied:
+        return denied
+
+    lease, expired = lease_manager.claim(worker_id, ttl)
+    _handle_expired_leases(expired, background_tasks)
+    if lease is None:
+        return Response(status_code=204)
+
+    audio_file = find_audio(lease.rid)
+    if not audio_file:
+        _, expired = lease_manager.release(lease.lease_id)
+        _handle_expired_leases(expired, background_tasks)
+        write_status(lease.rid, "error", mode=lease.mode, error="record_not_found")
+        background_tasks.add_task(_sync_index_state, lease.rid, "error")
+        return Response(status_code=204)
+
+    transcript_file = data_file(lease.rid, ".txt")
+    payload = _lease_payload(lease)
+    payload.update({
+        "audio_filename": audio_file.name,
+        "audio_url": f"/worker/lease/{lease.lease_id}/audio",
+        # 仅总结模式需要已有转写
+        "transcript": transcript_file.read_text(encoding="utf-8") if lease.mode == "summarize" and transcript_file.exists() else "",
+    })
+    write_status(lease.rid, "running", mode=lease.mode, started_at=int(lease.created_at), message=f"leased by {worker_id}")
+    background_tasks.add_task(_sync_index_state, lease.rid, "running")
+    return JSONResponse(payload)
+
+
+@app.post("/worker/lease/{lease_id}/heartbeat")
+async def worker_heartbeat(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    lease_id: str,
+    state: Optional[str] = Form(None),
+    ttl: Optional[int] = Form(None),
+):
+    """worker 续约，可顺带上报当前阶段（transcribing / summarizing）"""
+    denied = _check_worker_token(request)
+    if denied:
+        return denied
+
+    lease = lease_manager.heartbeat(lease_id, ttl)
+    if lease is None:
+        return JSONResponse({"error": "lease_lost"}, status_code=410)
+    if state in ("transcribing", "summarizing"):
+        st = read_status(lease.rid)
+        if st.get("state") != state:
+            write_status(lease.rid, state, mode=lease.mode, started_at=int(lease.created_at), message=f"{state} on {lease.worker_id}")
+            background_tasks.add_task(_sync_index_state, lease.rid, state)
+    return JSONResponse(_lease_payload(lease))
+
+
+@app.get("/worker/lease/{lease_id}/audio")
+async def worker_audio(request: Request, lease_id: str):
+    denied = _check_worker_token(request)
+    if denied:
+        return denied
+
+    lease = lease_manager.get(lease_id)
+    if lease is None:
+        return JSONResponse({"error": "lease_lost"}, status_code=410)
+    audio_file = find_audio(lease.rid)
+    if not audio_file:
+        return JSONResponse({"error": "record_not_found"}, status_code=404)
+    return FileResponse(str(audio_file), filename=audio_file.name)
+
+
+@app.post("/worker/lease/{lease_id}/complete")
+async def worker_complete(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    lease_id: str,
+    transcript: Optional[str] = Form(None),
+    summary: Optional[str] = Form(None),
+):
+    """worker 上传结果：写回转写/总结、更新索引并结束租约"""
+    denied = _check_worker_token(request)
+    if denied:
+        return denied
+
+    lease, expired = lease_manager.release(lease_id)
+    _handle_expired_leases(expired, background_tasks)
+    if lease is None:
+        # 租约已过期或任务已被重新投递，丢弃结果
+        return JSONResponse({"error": "lease_lost"}, status_code=410)
+
+    rid = lease.rid
+    transcript_file = data_file(rid, ".txt")
+    if lease.mode in ("transcribe", "all"):
+        transcript_file.write_text(transcript or "", encoding="utf-8")
+        # worker 使用各自配置的模型，不参与本机的两遍转写
+        update_meta(rid, transcript_model=None, transcript_tier=None)
+    else:
+        transcript = transcript_file.read_text(encoding="utf-8") if transcript_file.exists() else ""
+    if lease.mode in ("summarize", "all"):
+        data_file(rid, ".summary.txt").write_text(summary or "", encoding="utf-8")
+
+    # 计算 embedding 与写向量库放到后台，不阻塞事件循环
+    background_tasks.add_task(_index_record, rid, summary if lease.mode in ("summarize", "all") and summary else transcript or "")
+    write_status(rid, "done", mode=lease.mode, started_at=int(lease.created_at), message=f"done by {lease.worker_id}")
+    return JSONResponse({"status": "ok", "rid": rid})
+
+
+@app.post("/worker/lease/{lease_id}/fail")
+async def worker_fail(request: Request, background_tasks: BackgroundTasks, lease_id: str, error: str = Form("")):
+    denied = _check_worker_token(request)
+    if denied:
+        return denied
+
+    lease, expired = lease_manager.release(lease_id)
+    _handle_expired_leases(expired, background_tasks)
+    if lease is None:
+        return JSONResponse({"error": "lease_lost"}, status_code=410)
+    data_file(lease.rid, ".error.txt").write_text(error, encoding="utf-8")
+    write_status(lease.rid, "error", mode=lease.mode, started_at=int(lease.created_at), error=error, message=f"failed on {lease.worker_id}")
+    background_tasks.add_task(_sync_index_state, lease.rid, "error")
+    return JSONResponse({"status": "ok", "rid": lease.rid})
+
+
+@app.get("/worker/queue")
+async def worker_queue(request: Request, background_tasks: BackgroundTasks):
+    """查看任务队列与在途租约"""
+    denied = _check_worker_token(request)
+    if denied:
+        return denied
+    _handle_expired_leases(lease_manager.reap_expired(), background_tasks)
+    return JSONResponse(lease_manager.stats())
@@ -0,0 +1,358 @@
+"""
+批量导入服务：扫描目录，把音频流式写入存储，并以流水线方式执行解码/转写、总结、建索引
+
+- 各阶段（copy → transcribe → summarize → index）使用独立线程池，阶段之间互相重叠
+- 同时在途的文件数量有上限，避免一次性把上千个文件压进内存/队列
+- 每个阶段完成后向 checkpoint 日志追加一行，中断后重新执行会从上次完成的阶段继续
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.services.storage import DATA_DIR, data_file, find_audio, new_audio_path, update_meta
+from app.services.transcribe import draft_model_size, foreground_task, transcribe_audio, upgrade_model_size
+from app.services.summarize import summarize_text_with_timeout
+
+
+AUDIO_SUFFIXES = {".wav", ".mp3", ".m4a", ".aac", ".flac", ".ogg"}
+
+# 阶段顺序；checkpoint 中记录的是“最后完成的阶段”
+STAGES = ["copied", "transcribed", "summarized", "done"]
+
+# 各阶段并发度（转写最重，默认单线程）
+COPY_WORKERS = int(os.getenv("IMPORT_COPY_WORKERS", "2"))
+TRANSCRIBE_WORKERS = int(os.getenv("IMPORT_TRANSCRIBE_WORKERS", "1"))
+SUMMARIZE_WORKERS = int(os.getenv("IMPORT_SUMMARIZE_WORKERS", "2"))
+INDEX_WORKERS = int(os.getenv("IMPORT_INDEX_WORKERS", "1"))
+# 同时在途（已开始但未结束）的文件数上限
+MAX_INFLIGHT = int(os.getenv("IMPORT_MAX_INFLIGHT", "8"))
+
+_COPY_CHUNK = 1024 * 1024
+
+# 正在导入的源目录，防止同一目录被重复并发导入
+_running: set = set()
+_running_lock = threading.Lock()
+
+
+def scan_audio_files(src_dir: Path) -> Iterator[Path]:
+    """递归扫描目录中的音频文件（按路径排序，保证多次导入顺序一致）"""
+    for p in sorted(src_dir.rglob("*")):
+        if p.is_file() and p.suffix.lower() in AUDIO_SUFFIXES and not p.name.endswith(".proc.wav"):
+            yield p
+
+
+def checkpoint_path(src_dir: Path) -> Path:
+    """
+    每个源目录对应一个 checkpoint 日志：data/imports/{hash}.jsonl
+
+    每行是一次更新 {"key": 相对路径, 字段...}，只追加不重写；按顺序回放即得到各文件的最新状态
+    """
+    key = hashlib.sha1(str(src_dir.resolve()).encode("utf-8")).hexdigest()[:16]
+    return DATA_DIR / "imports" / f"{key}.jsonl"
+
+
+def _legacy_checkpoint_path(src_dir: Path) -> Path:
+    # 旧版整文件 JSON checkpoint
+    return checkpoint_path(src_dir).with_suffix(".json")
+
+
+def read_checkpoint(src_dir: Path) -> Dict[str, Any]:
+    checkpoint: Dict[str, Any] = {"src_dir": str(src_dir.resolve()), "files": {}}
+    legacy = _legacy_checkpoint_path(src_dir)
+    if legacy.exists():
+        try:
+            checkpoint["files"] = json.loads(legacy.read_text(encoding="utf-8")).get("files", {})
+        except Exception:
+            pass
+
+    p = checkpoint_path(src_dir)
+    if p.exists():
+        with open(p, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # 中断时可能留下半行
+                key = record.pop("key", None)
+                if not key:
+                    continue
+                checkpoint["files"].setdefault(key, {}).update(record)
+
+    updated = [e.get("updated_at") or 0 for e in checkpoint["files"].values()]
+    if updated:
+        checkpoint["updated_at"] = max(updated)
+    return checkpoint
+
+
+def _write_checkpoint(src_dir: Path, checkpoint: Dict[str, Any]) -> None:
+    """把日志压缩为每个文件一行（导入开始时执行一次），并移除旧版 JSON"""
+    p = checkpoint_path(src_dir)
+    tmp = p.with_name(p.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        for key, entry in checkpoint["files"].items():
+            f.write(json.dumps({"key": key, **entry}, ensure_ascii=False) + "\n")
+    os.replace(tmp, p)
+    _legacy_checkpoint_path(src_dir).unlink(missing_ok=True)
+
+
+def summarize_checkpoint(checkpoint: Dict[str, Any]) -> Dict[str, int]:
+    """统计各阶段的文件数量"""
+    stats: Dict[str, int] = {"total": 0, "error": 0, "index_error": 0}
+    for stage in STAGES:
+        stats[stage] = 0
+    for entry in checkpoint.get("files", {}).values():
+        stats["total"] += 1
+        if entry.get("error"):
+            stats["error"] += 1
+        if entry.get("index_error"):
+            stats["index_error"] += 1
+        stage = entry.get("stage")
+        if stage in stats:
+            stats[stage] += 1
+    return stats
+
+
+class ImportPipeline:
+    """
+    目录导入流水线
+
+    Args:
+        src_dir: 待导入的源目录
+        write_status: 状态写入函数（与 app.main.write_status 签名一致）
+        on_record_done: 每条记录导入完成后的回调（服务进程内导入时用于安排转写升级）
+    """
+
+    def __init__(
+        self,
+        src_dir: Path,
+        write_status: Callable[..., Dict[str, Any]],
+        on_record_done: Optional[Callable[[str], None]] = None,
+    ):
+        self.src_dir = src_dir.resolve()
+        self.write_status = write_status
+        self.on_record_done = on_record_done
+
+        self._lock = threading.Lock()
+        self._inflight = threading.BoundedSemaphore(MAX_INFLIGHT)
+        self._checkpoint = read_checkpoint(self.src_dir)
+        self._checkpoint_file = checkpoint_path(self.src_dir)
+        self._checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+        _write_checkpoint(self.src_dir, self._checkpoint)
+        self._journal = open(self._checkpoint_file, "a", encoding="utf-8")
+
+        self._pools = {
+            "copy": ThreadPoolExecutor(max_workers=COPY_WORKERS, thread_name_prefix="import-copy"),
+            "transcribe": ThreadPoolExecutor(max_workers=TRANSCRIBE_WORKERS, thread_name_prefix="import-transcribe"),
+            "summarize": ThreadPoolExecutor(max_workers=SUMMARIZE_WORKERS, thread_name_prefix="import-summarize"),
+            "index": ThreadPoolExecutor(max_workers=INDEX_WORKERS, thread_name_prefix="import-index"),
+        }
+
+    # ---- checkpoint ----
+
+    def _entry(self, key: str) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._checkpoint["files"].get(key, {}))
+
+    def _update(self, key: str, **fields: Any) -> None:
+        fields["updated_at"] = int(time.time())
+        line = json.dumps({"key": key, **fields}, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._checkpoint["files"].setdefault(key, {}).update(fields)
+            self._checkpoint["updated_at"] = fields["updated_at"]
+            # 只追加一行，开销与已导入文件数无关；中断时最多丢失/截断最后一行
+            self._journal.write(line)
+            self._journal.flush()
+
+    # ---- 阶段实现 ----
+
+    def _copy(self, key: str, src: Path) -> str:
+        entry = self._entry(key)
+        rid = entry.get("rid")
+        if not rid:
+            # 先记下 rid 再复制：复制后中断时，重新导入会复用同一条记录而不是再建一条
+            rid = uuid.uuid4().hex
+            self._update(key, rid=rid)
+        target = new_audio_path(rid, src.suffix.lower())
+
+        # 分块流式复制，不把整个文件读入内存；临时文件放在 imports/ 下，避免被当作音频
+        tmp = self._checkpoint_file.parent / f"{target.name}.part"
+        with open(src, "rb") as fin, open(tmp, "wb") as fout:
+            shutil.copyfileobj(fin, fout, _COPY_CHUNK)
+        os.replace(tmp, target)
+
+        meta = {
+            "rid": rid,
+            "original_filename": src.name,
+            # 历史录音以源文件修改时间作为创建时间
+            "created_at": int(src.stat().st_mtime),
+            "imported_from": key,
+        }
+        data_file(rid, ".meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+        self.write_status(rid, "queued", mode="all", message="imported, waiting for transcription")
+        self._update(key, stage="copied", error=None)
+        return rid
+
+    def _transcribe(self, key: str, rid: str) -> None:
+        audio_file = find_audio(rid)
+        if not audio_file:
+            raise RuntimeError("record_not_found")
+        self.write_status(rid, "transcribing", mode="all", message="transcribing (import)")
+        # 计入前台任务，服务进程内的后台升级转写会让出
+        with foreground_task():
+            transcript = transcribe_audio(str(audio_file), work_dir=str(DATA_DIR / "processed"))
+        data_file(rid, ".txt").write_text(transcript, encoding="utf-8")
+        # 启用两遍转写时标记为草稿，由服务进程在空闲时升级
+        update_meta(
+            rid,
+            transcript_model=draft_model_size(),
+            transcript_tier="draft" if upgrade_model_size() else None,
+        )
+        self._update(key, stage="transcribed", error=None)
+
+    def _summarize(self, key: str, rid: str) -> None:
+        transcript = data_file(rid, ".txt").read_text(encoding="utf-8")
+        self.write_status(rid, "summarizing", mode="all", message="summarizing (import)")
+        # 与页面任务相同的超时保护：超时记为该文件的 summarize 错误，不阻塞流水线
+        with foreground_task():
+            summary = summarize_text_with_timeout(transcript)
+        data_file(rid, ".summary.txt").write_text(summary, encoding="utf-8")
+        self._update(key, stage="summarized", error=None)
+
+    def _index(self, key: str, rid: str) -> None:
+        summary_file = data_file(rid, ".summary.txt")
+        transcript_file = data_file(rid, ".txt")
+        text = summary_file.read_text(encoding="utf-8") if summary_file.exists() else ""
+        if not text and transcript_file.exists():
+            text = transcript_file.read_text(encoding="utf-8")
+        meta_path = data_file(rid, ".meta.json")
+        metadata = json.loads(meta_path.read_text(encoding="utf-8")) if meta_path.exists() else {}
+        metadata["state"] = "done"
+        # 索引更新失败不影响主流程：转写与总结已完成，错误只记在 checkpoint 中，之后可重建索引
+        index_error = None
+        try:
+            from app.services.vector_store import add_document
+            if text:
+                add_document(rid, text, metadata)
+        except Exception as e:
+            index_error = str(e)
+        self.write_status(rid, "done", mode="all", message="done (import)")
+        self._update(key, stage="done", error=None, index_error=index_error)
+        if self.on_record_done:
+            self.on_record_done(rid)
+
+    # ---- 调度 ----
+
+    def _next(self, key: str, rid: Optional[str], stage: Optional[str]) -> None:
+        """根据已完成的阶段，把文件投递到下一阶段的线程池"""
+        if stage is None:
+            self._pools["copy"].submit(self._step, key, "copy", self._copy, key, self._src(key))
+        elif stage == "copied":
+            self._pools["transcribe"].submit(self._step, key, "transcribe", self._transcribe, key, rid)
+        elif stage == "transcribed":
+            self._pools["summarize"].submit(self._step, key, "summarize", self._summarize, key, rid)
+        elif stage == "summarized":
+            self._pools["index"].submit(self._step, key, "index", self._index, key, rid)
+        else:
+            self._inflight.release()
+
+    def _src(self, key: str) -> Path:
+        return self.src_dir / key
+
+    def _step(self, key: str, name: str, fn: Callable[..., Any], *args: Any) -> None:
+        try:
+            result = fn(*args)
+        except Exception as e:
+            entry = self._entry(key)
+            self._update(key, error=f"{name}: {e}")
+            if entry.get("rid"):
+                # 已入库的记录再次导入失败时，同步状态到索引元数据
+                try:
+                    from app.services.vector_store import update_document_state
+                    update_document_state(entry["rid"], "error")
+                except Exception:
+                    pass
+                self.write_status(entry["rid"], "error", mode="all", error=str(e), message=f"import {name} failed")
+            self._inflight.release()
+            return
+        entry = self._entry(key)
+        rid = result if name == "copy" else entry.get("rid")
+        self._next(key, rid, entry.get("stage"))
+
+    def run(self) -> Dict[str, int]:
+        """执行导入（阻塞直到所有文件处理完成），返回各阶段统计"""
+        try:
+            for src in scan_audio_files(self.src_dir):
+                key = src.relative_to(self.src_dir).as_posix()
+                entry = self._entry(key)
+                stage = entry.get("stage")
+                if stage == "done":
+                    continue
+                # checkpoint 异常（有阶段但没有 rid）时从头开始
+                if stage and not entry.get("rid"):
+                    stage = None
+                self._inflight.acquire()
+                self._next(key, entry.get("rid"), stage)
+
+            # 等待所有在途文件结束：把信号量全部拿回来
+            for _ in range(MAX_INFLIGHT):
+                self._inflight.acquire()
+            for _ in range(MAX_INFLIGHT):
+                self._inflight.release()
+        finally:
+            for pool in self._pools.values():
+                pool.shutdown(wait=True)
+            with self._lock:
+                self._journal.close()
+
+        with self._lock:
+            return summarize_checkpoint(self._checkpoint)
+
+
+def is_import_running(src_dir: Path) -> bool:
+    """该目录是否正在本进程中导入"""
+    with _running_lock:
+        return str(src_dir.resolve()) in _running
+
+
+def run_import(
+    src_dir: Path,
+    write_status: Callable[..., Dict[str, Any]],
+    on_record_done: Optional[Callable[[str], None]] = None,
+) -> Dict[str, int]:
+    """导入一个目录（可重复执行，已完成的文件会被跳过）"""
+    if not src_dir.is_dir():
+        raise NotADirectoryError(str(src_dir))
+    key = str(src_dir.resolve())
+    with _running_lock:
+        if key in _running:
+            raise RuntimeError(f"import already running: {key}")
+        _running.add(key)
+    try:
+        return ImportPipeline(src_dir, write_status, on_record_done).run()
+    finally:
+        with _running_lock:
+            _running.discard(key)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="批量导入目录中的音频（支持断点续传）")
+    parser.add_argument("src_dir", help="音频所在目录（递归扫描）")
+    args = parser.parse_args(argv)
+
+    from app.main import write_status
+
+    stats = run_import(Path(args.src_dir), write_status)
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+导出服务：单条记录导出为 Markdown，批量导出为流式生成的 ZIP（可包含音频）
+
+- ZIP 边生成边输出，音频按块复制，内存占用与导出总量无关
+- 每条记录渲染好的 Markdown 缓存在记录目录下（{rid}.export.md），渲染时源文件的 mtime/大小
+  记在 {rid}.export.json 中，与当前源文件不一致时重新渲染
+"""
+import io
+import json
+import re
+import time
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from app.services.storage import content_dir, data_file, find_audio, iter_rids, read_meta, write_text_atomic
+
+
+_CHUNK = 1024 * 1024
+# Markdown 缓存依赖的源文件
+_SOURCE_SUFFIXES = [".txt", ".summary.txt", ".meta.json"]
+
+
+def _created_at(rid: str) -> int:
+    meta = read_meta(rid)
+    if meta.get("created_at"):
+        return int(meta["created_at"])
+    audio = find_audio(rid)
+    return int(audio.stat().st_mtime) if audio else 0
+
+
+def _read(path: Path) -> str:
+    return path.read_text(encoding="utf-8") if path.exists() else ""
+
+
+def render_markdown(rid: str, content: Optional[Path] = None) -> str:
+    # 元信息、总结、转写取自同一代
+    content = content or content_dir(rid)
+    meta = read_meta(rid, content)
+    audio = find_audio(rid)
+    title = meta.get("original_filename") or (audio.name if audio else rid)
+    created_at = time.strftime("%Y-%m-%d %H:%M", time.localtime(_created_at(rid)))
+    summary = _read(data_file(rid, ".summary.txt", content)).strip()
+    transcript = _read(data_file(rid, ".txt", content)).strip()
+
+    lines = [
+        f"# {title}",
+        "",
+        f"- 记录ID：`{rid}`",
+        f"- 创建时间：{created_at}",
+    ]
+    if meta.get("transcript_model"):
+        lines.append(f"- 转写模型：{meta['transcript_model']}")
+    if audio:
+        lines.append(f"- 音频：{audio.name}")
+    lines += [
+        "",
+        "## 总结",
+        "",
+        summary or "（无）",
+        "",
+        "## 转写",
+        "",
+        transcript or "（无）",
+        "",
+    ]
+    return "\n".join(lines)
+
+
+def _source_signature(rid: str, content: Path) -> Dict[str, Any]:
+    """源文件所在的代以及各源文件的 [mtime_ns, 大小]，不存在为 None"""
+    signature: Dict[str, Any] = {"generation": content.name}
+    for suffix in _SOURCE_SUFFIXES:
+        try:
+            st = data_file(rid, suffix, content).stat()
+            signature[suffix] = [st.st_mtime_ns, st.st_size]
+        except FileNotFoundError:
+            signature[suffix] = None
+    return signature
+
+
+def markdown_path(rid: str) -> Path:
+    """返回记录的 Markdown 文件（必要时重新渲染并缓存）"""
+    cache = data_file(rid, ".export.md")
+    sidecar = data_file(rid, ".export.json")
+    # 在读取源文件之前取签名：渲染期间源文件被改写时，签名对不上，下次会重新渲染
+    content = content_dir(rid)
+    signature = _source_signature(rid, content)
+    try:
+        cached = json.loads(sidecar.read_text(encoding="utf-8"))
+    except Exception:
+        cached = None
+    if not cache.exists() or cached != signature:
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        write_text_atomic(cache, render_markdown(rid, content))
+        write_text_atomic(sidecar, json.dumps(signature))
+    return cache
+
+
+def parse_date(value: Optional[str], end_of_day: bool = False) -> Optional[int]:
+    """解析 YYYY-MM-DD（本地时间）为时间戳；end_of_day 时取当天结束"""
+    if not value:
+        return None
+    day = datetime.strptime(value, "%Y-%m-%d")
+    if end_of_day:
+        day += timedelta(days=1)
+        return int(day.timestamp()) - 1
+    return int(day.timestamp())
+
+
+def select_rids(
+    rids: Optional[Iterable[str]] = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> List[str]:
+    """按指定记录或创建时间范围选择要导出的记录（按时间正序）"""
+    candidates = list(rids) if rids else list(iter_rids())
+    selected = []
+    for rid in candidates:
+        if not find_audio(rid):
+            continue
+        created_at = _created_at(rid)
+        if start is not None and created_at < start:
+            continue
+        if end is not None and created_at > end:
+            continue
+        selected.append((created_at, rid))
+    return [rid for _, rid in sorted(selected)]
+
+
+class _ZipSink(io.RawIOBase):
+    """不可 seek 的写入端：zipfile 写入的数据暂存于此，由生成器及时取走"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _safe_name(name: str) -> str:
+    return re.sub(r'[\\/:*?"<>|\s]+', "_", name).strip("._") or "record"
+
+
+def stream_zip(rids: List[str], include_audio: bool = False) -> Iterator[bytes]:
+    """逐条写入 ZIP 并即时输出字节块"""
+    sink = _ZipSink()
+    index_lines = ["# Audio Diary 导出", "", f"共 {len(rids)} 条记录", ""]
+
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for rid in rids:
+            audio = find_audio(rid)
+            if not audio:
+                continue
+            meta = read_meta(rid)
+            created_at = _created_at(rid)
+            stem = Path(meta.get("original_filename") or audio.name).stem
+            folder = f"{time.strftime('%Y-%m-%d', time.localtime(created_at))}_{_safe_name(stem)}_{rid[:8]}"
+            date_time = time.localtime(max(created_at, 315532800))[:6]  # ZIP 不支持 1980 年以前的时间
+
+            md_info = zipfile.ZipInfo(f"{folder}/{_safe_name(stem)}.md", date_time=date_time)
+            md_info.compress_type = zipfile.ZIP_DEFLATED
+            zf.writestr(md_info, markdown_path(rid).read_bytes())
+            yield sink.drain()
+
+            if include_audio:
+                # 音频本身已压缩，直接存储
+                audio_info = zipfile.ZipInfo(f"{folder}/{_safe_name(stem)}{audio.suffix}", date_time=date_time)
+                audio_info.compress_type = zipfile.ZIP_STORED
+                with open(audio, "rb") as src, zf.open(audio_info, mode="w", force_zip64=True) as dest:
+                    while True:
+                        chunk = src.read(_CHUNK)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        yield sink.drain()
+                yield sink.drain()
+
+            index_lines.append(f"- [{meta.get('original_filename') or audio.name}]({folder}/{_safe_name(stem)}.md)")
+
+        zf.writestr("index.md", "\n".join(index_lines) + "\n")
+    yield sink.drain()
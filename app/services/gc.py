@@ -0,0 +1,215 @@
+"""
+存储垃圾回收：清理孤立的记录文件与临时文件，清理向量库中的失效条目，并在删除累积过多时压缩集合
+
+回收对象：
+- 数据目录存在但音频已不存在的记录（残留的 meta/status/转写/总结）
+- 没有音频文件的空音频目录
+- 已完成任务遗留的 .error.txt
+- data/processed 下转写失败残留的 .proc.wav、data/imports 下中断导入残留的 .part
+- 向量库中对应记录已不存在的条目
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+from app.services.storage import (
+    DATA_DIR,
+    audio_dir,
+    data_file,
+    find_audio,
+    has_flat_layout,
+    iter_data_rids,
+    iter_rids,
+    record_dir,
+)
+
+
+# 调度间隔（秒），0 表示不启用定时回收
+GC_INTERVAL_SECONDS = int(os.getenv("GC_INTERVAL_SECONDS", "21600"))
+# 每批删除的数量；批次之间短暂让出 IO
+GC_BATCH_SIZE = int(os.getenv("GC_BATCH_SIZE", "200"))
+# 新文件/目录的保护期，避免误删正在上传或转写中的文件
+GC_GRACE_SECONDS = int(os.getenv("GC_GRACE_SECONDS", "3600"))
+# 删除条目数占现存条目的比例超过阈值时压缩向量集合
+GC_COMPACT_RATIO = float(os.getenv("GC_COMPACT_RATIO", "0.2"))
+GC_COMPACT_MIN_DELETED = int(os.getenv("GC_COMPACT_MIN_DELETED", "100"))
+
+_gc_lock = threading.Lock()
+
+
+def _size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def _is_old(path: Path, now: float) -> bool:
+    try:
+        return now - path.stat().st_mtime > GC_GRACE_SECONDS
+    except FileNotFoundError:
+        return False
+
+
+def find_orphans() -> Iterator[Path]:
+    """找出可回收的文件与目录"""
+    now = time.time()
+
+    # 音频已不存在的数据目录
+    for rid in iter_data_rids():
+        d = record_dir(rid)
+        if find_audio(rid) is None and _is_old(d, now):
+            yield d
+
+    # 空的音频目录
+    for rid in iter_rids():
+        d = audio_dir(rid)
+        if find_audio(rid) is None and _is_old(d, now):
+            yield d
+
+    # 已完成任务遗留的错误文件
+    for rid in iter_rids():
+        error_file = data_file(rid, ".error.txt")
+        if not error_file.exists():
+            continue
+        try:
+            state = json.loads(data_file(rid, ".status.json").read_text(encoding="utf-8")).get("state")
+        except Exception:
+            continue
+        if state == "done":
+            yield error_file
+
+    # 临时文件
+    for sub, pattern in (("processed", "*.proc.wav"), ("imports", "*.part")):
+        tmp_dir = DATA_DIR / sub
+        if not tmp_dir.is_dir():
+            continue
+        for p in tmp_dir.glob(pattern):
+            if _is_old(p, now):
+                yield p
+
+
+def _batches(items: Iterator[Any], size: int) -> Iterator[List[Any]]:
+    batch: List[Any] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def collect_garbage(dry_run: bool = False, compact: bool = True) -> Dict[str, Any]:
+    """
+    执行一次垃圾回收
+
+    Args:
+        dry_run: 只统计不删除
+        compact: 删除条目超过阈值时是否压缩向量集合
+
+    Returns:
+        统计信息：删除的文件/目录数、回收字节数、删除的索引条目数、是否压缩及索引回收字节数
+    """
+    stats: Dict[str, Any] = {
+        "dry_run": dry_run,
+        "paths_removed": 0,
+        "bytes_reclaimed": 0,
+        "index_entries_removed": 0,
+        "compacted": False,
+        "index_bytes_reclaimed": 0,
+    }
+    if not _gc_lock.acquire(blocking=False):
+        stats["skipped"] = "gc already running"
+        return stats
+    # 未迁移（或迁移中断）的平铺布局中的记录对回收不可见，会被误判为孤立/失效：整体跳过
+    if has_flat_layout():
+        _gc_lock.release()
+        stats["skipped"] = "flat layout not migrated, run `python -m app.services.storage migrate`"
+        return stats
+
+    try:
+        # 1) 文件系统
+        for batch in _batches(find_orphans(), GC_BATCH_SIZE):
+            for p in batch:
+                try:
+                    size = _size(p)
+                    if not dry_run:
+                        if p.is_dir():
+                            shutil.rmtree(p)
+                        else:
+                            p.unlink()
+                    stats["paths_removed"] += 1
+                    stats["bytes_reclaimed"] += size
+                except FileNotFoundError:
+                    pass
+            time.sleep(0.01)
+
+        # 2) 向量库
+        try:
+            from app.services import vector_store
+        except Exception:
+            return stats  # 未安装向量检索依赖
+
+        # 先取索引 ID 再取现存记录，避免把本次回收期间新建并入库的记录误判为失效
+        indexed = vector_store.list_document_ids()
+        live = set(iter_rids())
+        if indexed and not live:
+            # 一条记录都看不到却有索引，多半是存储目录异常：宁可不删
+            stats["index_skipped"] = "no live records found"
+            return stats
+        stale = [rid for rid in indexed if rid not in live]
+        for batch in _batches(iter(stale), GC_BATCH_SIZE):
+            if dry_run:
+                stats["index_entries_removed"] += len(batch)
+            else:
+                stats["index_entries_removed"] += vector_store.delete_documents(batch)
+
+        deleted = vector_store.deleted_since_compaction()
+        stats["index_deleted_since_compaction"] = deleted
+        if (
+            compact
+            and not dry_run
+            and deleted >= GC_COMPACT_MIN_DELETED
+            and deleted >= GC_COMPACT_RATIO * max(len(live), 1)
+        ):
+            result = vector_store.compact_collection()
+            stats["compacted"] = True
+            stats["index_bytes_reclaimed"] = max(result["bytes_before"] - result["bytes_after"], 0)
+        return stats
+    finally:
+        _gc_lock.release()
+
+
+def start_gc_scheduler(interval: int = GC_INTERVAL_SECONDS) -> None:
+    """启动后台定时回收线程（interval <= 0 时不启动）"""
+    if interval <= 0:
+        return
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                stats = collect_garbage()
+                print(f"[gc] {stats}", flush=True)
+            except Exception as e:
+                print(f"[gc] failed: {e}", flush=True)
+
+    threading.Thread(target=loop, name="storage-gc", daemon=True).start()
+
+
+def main(argv=None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Audio Diary 存储垃圾回收")
+    parser.add_argument("--dry-run", action="store_true", help="只统计不删除")
+    parser.add_argument("--no-compact", action="store_true", help="不压缩向量集合")
+    args = parser.parse_args(argv)
+    print(json.dumps(collect_garbage(dry_run=args.dry_run, compact=not args.no_compact), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
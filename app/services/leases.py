@@ -0,0 +1,136 @@
+"""
+任务租约：供独立 worker 进程（可在其他机器上）拉取转写/总结任务
+
+- 服务端把任务放入队列，worker 通过 claim 领取并获得一个有过期时间的租约
+- worker 需定期 heartbeat 续约；租约过期后任务会被回收并重新排队
+- 租约只保存在服务端内存中，服务重启后由调用方根据 status.json 重新入队
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+
+@dataclass
+class Lease:
+    lease_id: str
+    rid: str
+    mode: str
+    worker_id: str
+    expires_at: float
+    attempts: int = 1
+    created_at: float = field(default_factory=time.time)
+
+
+class LeaseManager:
+    """
+    线程安全的内存任务队列 + 租约表
+
+    Args:
+        default_ttl: 默认租约时长（秒）
+        max_attempts: 单个任务最多被领取的次数，超过后不再回收
+    """
+
+    def __init__(self, default_ttl: int = 120, max_attempts: int = 3):
+        self.default_ttl = default_ttl
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # rid -> (mode, 已领取次数)；OrderedDict 保证先进先出且同一 rid 只排一次
+        self._queue: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._leases: Dict[str, Lease] = {}
+
+    def enqueue(self, rid: str, mode: str) -> None:
+        """入队；若该记录已有未完成的租约则作废（旧 worker 的结果会被拒绝）"""
+        with self._lock:
+            for lease_id, lease in list(self._leases.items()):
+                if lease.rid == rid:
+                    del self._leases[lease_id]
+            self._queue.pop(rid, None)
+            self._queue[rid] = (mode, 0)
+
+    def claim(self, worker_id: str, ttl: Optional[int] = None) -> Tuple[Optional[Lease], List[Lease]]:
+        """
+        领取一个任务
+
+        Returns:
+            (新租约或 None, 本次回收的过期租约列表)
+        """
+        with self._lock:
+            expired = self._reap_locked()
+            if not self._queue:
+                return None, expired
+            rid, (mode, attempts) = self._queue.popitem(last=False)
+            lease = Lease(
+                lease_id=uuid.uuid4().hex,
+                rid=rid,
+                mode=mode,
+                worker_id=worker_id,
+                expires_at=time.time() + (ttl or self.default_ttl),
+                attempts=attempts + 1,
+            )
+            self._leases[lease.lease_id] = lease
+            return lease, expired
+
+    def heartbeat(self, lease_id: str, ttl: Optional[int] = None) -> Optional[Lease]:
+        """续约；租约不存在或已过期时返回 None"""
+        with self._lock:
+            lease = self._leases.get(lease_id)
+            if lease is None or lease.expires_at < time.time():
+                return None
+            lease.expires_at = time.time() + (ttl or self.default_ttl)
+            return lease
+
+    def get(self, lease_id: str) -> Optional[Lease]:
+        with self._lock:
+            lease = self._leases.get(lease_id)
+            if lease is None or lease.expires_at < time.time():
+                return None
+            return lease
+
+    def release(self, lease_id: str) -> Tuple[Optional[Lease], List[Lease]]:
+        """
+        结束租约（完成或失败）
+
+        先回收过期租约，迟到的结果不会把已过期的任务从队列中弄丢
+
+        Returns:
+            (被结束的租约或 None, 本次回收的过期租约列表)
+        """
+        with self._lock:
+            expired = self._reap_locked()
+            return self._leases.pop(lease_id, None), expired
+
+    def reap_expired(self) -> List[Lease]:
+        """回收过期租约：未超过最大次数的重新排到队首"""
+        with self._lock:
+            return self._reap_locked()
+
+    def _reap_locked(self) -> List[Lease]:
+        now = time.time()
+        expired = [l for l in self._leases.values() if l.expires_at < now]
+        for lease in expired:
+            del self._leases[lease.lease_id]
+            if lease.attempts < self.max_attempts and lease.rid not in self._queue:
+                self._queue[lease.rid] = (lease.mode, lease.attempts)
+                self._queue.move_to_end(lease.rid, last=False)
+        return expired
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "queued": len(self._queue),
+                "leased": len(self._leases),
+                "leases": [
+                    {
+                        "lease_id": l.lease_id,
+                        "rid": l.rid,
+                        "mode": l.mode,
+                        "worker_id": l.worker_id,
+                        "expires_at": int(l.expires_at),
+                        "attempts": l.attempts,
+                    }
+                    for l in self._leases.values()
+                ],
+            }
@@ -0,0 +1,278 @@
+"""
+存储布局：按记录分目录，并用 rid 哈希前缀分桶，避免单个目录下堆积海量文件
+
+    uploads/{bucket}/{rid}/{rid}.{ext}          # 音频
+    data/{bucket}/{rid}/{rid}.txt               # 转写
+    data/{bucket}/{rid}/{rid}.summary.txt       # 总结
+    data/{bucket}/{rid}/{rid}.meta.json         # 元信息
+    data/{bucket}/{rid}/{rid}.status.json       # 任务状态
+    data/{bucket}/{rid}/{rid}.error.txt         # 错误信息
+
+bucket = sha1(rid) 的前两位十六进制，rid → 路径为直接计算，无需扫描目录。
+
+转写、总结与元信息会被后台升级整体替换，按“代”存放：初始代就在记录目录下，
+之后每一代写在 data/{bucket}/{rid}/v{n}/ 中，写完后原子替换指针文件 {rid}.current 切换，
+读者通过 data_file / content_dir 解析，要么看到整套旧内容，要么看到整套新内容。
+rid 必须是 32 位小写十六进制（uuid4().hex），其他值一律拒绝，避免拼出 `..` 之类的路径。
+旧版平铺布局可通过 `python -m app.services.storage migrate` 原地迁移。
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+UPLOAD_DIR = BASE_DIR / "uploads"
+DATA_DIR = BASE_DIR / "data"
+
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+# data 目录下每条记录的文件后缀（顺序：长后缀在前，便于解析旧文件名）
+DATA_SUFFIXES = [".summary.txt", ".meta.json", ".status.json", ".error.txt", ".txt"]
+
+# 按代存放、整体切换的文件
+GENERATION_SUFFIXES = {".txt", ".summary.txt", ".meta.json"}
+
+_HEX = set("0123456789abcdef")
+_RID_RE = re.compile(r"^[0-9a-f]{32}$")
+_GEN_RE = re.compile(r"^v(\d+)$")
+
+
+def is_valid_rid(rid: str) -> bool:
+    return bool(_RID_RE.match(rid or ""))
+
+
+def _check_rid(rid: str) -> str:
+    if not is_valid_rid(rid):
+        raise ValueError(f"invalid rid: {rid!r}")
+    return rid
+
+
+def bucket_of(rid: str) -> str:
+    return hashlib.sha1(rid.encode("utf-8")).hexdigest()[:2]
+
+
+def _is_bucket(p: Path) -> bool:
+    return p.is_dir() and len(p.name) == 2 and set(p.name) <= _HEX
+
+
+def audio_dir(rid: str) -> Path:
+    return UPLOAD_DIR / bucket_of(_check_rid(rid)) / rid
+
+
+def record_dir(rid: str) -> Path:
+    return DATA_DIR / bucket_of(_check_rid(rid)) / rid
+
+
+def _pointer_file(rid: str) -> Path:
+    return record_dir(rid) / f"{rid}.current"
+
+
+def content_dir(rid: str) -> Path:
+    """当前代所在目录：从未切换过时为记录目录本身，否则为记录目录下的 v{n}"""
+    base = record_dir(rid)
+    try:
+        name = _pointer_file(rid).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return base
+    return base / name if _GEN_RE.match(name) else base
+
+
+def data_file(rid: str, suffix: str, content: Optional[Path] = None) -> Path:
+    """
+    记录的数据文件路径，如 data_file(rid, ".summary.txt")
+
+    按代存放的文件默认解析到当前代；需要同一代的多个文件时，先取一次 content_dir 再传入 content
+    """
+    if suffix in GENERATION_SUFFIXES:
+        return (content or content_dir(rid)) / f"{rid}{suffix}"
+    return record_dir(rid) / f"{rid}{suffix}"
+
+
+def new_generation(rid: str) -> Path:
+    """创建下一代的空目录；写好文件后用 publish_generation 切换（调用方需持有记录锁）"""
+    current = content_dir(rid)
+    m = _GEN_RE.match(current.name) if current != record_dir(rid) else None
+    d = record_dir(rid) / f"v{int(m.group(1)) + 1 if m else 1}"
+    if d.exists():
+        shutil.rmtree(d)  # 上次中断留下的未发布目录
+    d.mkdir(parents=True)
+    return d
+
+
+def publish_generation(rid: str, gen_dir: Path) -> None:
+    """原子切换到新一代，并清理更早的代（保留上一代，正在读取旧路径的请求不受影响）"""
+    base = record_dir(rid)
+    previous = content_dir(rid)
+    write_text_atomic(_pointer_file(rid), gen_dir.name)
+    keep = {gen_dir, previous}
+    for d in base.iterdir():
+        if d.is_dir() and _GEN_RE.match(d.name) and d not in keep:
+            shutil.rmtree(d, ignore_errors=True)
+    if base not in keep:
+        for suffix in GENERATION_SUFFIXES:
+            (base / f"{rid}{suffix}").unlink(missing_ok=True)
+
+
+def write_text_atomic(path: Path, text: str) -> None:
+    """先写临时文件再替换，读者要么看到旧内容要么看到新内容"""
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def read_meta(rid: str, content: Optional[Path] = None) -> Dict[str, Any]:
+    p = data_file(rid, ".meta.json", content)
+    if p.exists():
+        try:
+            return json.loads(p.read_text(encoding="utf-8"))
+        except Exception:
+            pass
+    return {}
+
+
+def update_meta(rid: str, **fields: Any) -> Dict[str, Any]:
+    """合并写入 meta.json（不存在则创建）；值为 None 的字段会被移除"""
+    meta = read_meta(rid)
+    for k, v in fields.items():
+        if v is None:
+            meta.pop(k, None)
+        else:
+            meta[k] = v
+    p = data_file(rid, ".meta.json")
+    p.parent.mkdir(parents=True, exist_ok=True)
+    write_text_atomic(p, json.dumps(meta, ensure_ascii=False, indent=2))
+    return meta
+
+
+def find_audio(rid: str) -> Optional[Path]:
+    """查找记录的音频文件（只列举该记录自己的目录）"""
+    d = audio_dir(rid)
+    if not d.is_dir():
+        return None
+    return next((p for p in d.iterdir() if p.is_file() and p.name.startswith(f"{rid}.")), None)
+
+
+def new_audio_path(rid: str, suffix: str) -> Path:
+    """为新记录创建目录并返回音频存储路径"""
+    audio_dir(rid).mkdir(parents=True, exist_ok=True)
+    record_dir(rid).mkdir(parents=True, exist_ok=True)
+    return audio_dir(rid) / f"{rid}{suffix}"
+
+
+def audio_url(path: Path) -> str:
+    """音频的静态访问地址（uploads 目录挂载在 /uploads）"""
+    return "/uploads/" + path.relative_to(UPLOAD_DIR).as_posix()
+
+
+def _iter_record_dirs(root: Path) -> Iterator[Path]:
+    if not root.is_dir():
+        return
+    for bucket in root.iterdir():
+        if not _is_bucket(bucket):
+            continue
+        for d in bucket.iterdir():
+            if d.is_dir() and is_valid_rid(d.name):
+                yield d
+
+
+def iter_rids() -> Iterator[str]:
+    """遍历所有有音频目录的记录 ID"""
+    for d in _iter_record_dirs(UPLOAD_DIR):
+        yield d.name
+
+
+def iter_data_rids() -> Iterator[str]:
+    """遍历所有有数据目录的记录 ID（可能包含音频已丢失的残留记录）"""
+    for d in _iter_record_dirs(DATA_DIR):
+        yield d.name
+
+
+def has_flat_layout() -> bool:
+    """是否仍有未迁移的旧版平铺文件（uploads/{rid}.ext 或 data/{rid}.*）"""
+    for item in UPLOAD_DIR.iterdir():
+        if item.is_file() and is_valid_rid(item.name.split(".", 1)[0]):
+            return True
+    for item in DATA_DIR.iterdir():
+        if item.is_file() and is_valid_rid(_parse_data_name(item.name) or ""):
+            return True
+    return False
+
+
+def delete_record_files(rid: str) -> bool:
+    """删除记录的音频目录与数据目录，返回是否删除了音频"""
+    removed = audio_dir(rid).is_dir()
+    for root, d in ((UPLOAD_DIR, audio_dir(rid)), (DATA_DIR, record_dir(rid))):
+        # 只删除严格位于桶目录下、名字等于 rid 的记录目录
+        if d.name != rid or d.parent.parent != root or d.parent.name != bucket_of(rid):
+            continue
+        if d.is_dir() and not d.is_symlink():
+            shutil.rmtree(d, ignore_errors=True)
+    return removed
+
+
+def _parse_data_name(name: str) -> Optional[str]:
+    for suffix in DATA_SUFFIXES:
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return None
+
+
+def migrate_flat_layout() -> Dict[str, int]:
+    """
+    把旧版平铺布局（uploads/{rid}.ext、data/{rid}.*）原地迁移到分桶目录，可重复执行
+
+    Returns:
+        统计信息：{"audio": 迁移音频数, "data": 迁移数据文件数, "skipped": 跳过数}
+    """
+    stats = {"audio": 0, "data": 0, "skipped": 0}
+
+    for item in list(UPLOAD_DIR.iterdir()):
+        if not item.is_file():
+            continue
+        # 转写预处理残留的临时文件不迁移
+        if item.name.endswith(".proc.wav"):
+            stats["skipped"] += 1
+            continue
+        rid = item.name.split(".", 1)[0]
+        if not is_valid_rid(rid):
+            stats["skipped"] += 1
+            continue
+        target = audio_dir(rid) / item.name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(item, target)
+        stats["audio"] += 1
+
+    for item in list(DATA_DIR.iterdir()):
+        if not item.is_file():
+            continue
+        rid = _parse_data_name(item.name)
+        if not rid or not is_valid_rid(rid):
+            stats["skipped"] += 1
+            continue
+        target = data_file(rid, item.name[len(rid):])
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(item, target)
+        stats["data"] += 1
+
+    return stats
+
+
+def main(argv=None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Audio Diary 存储工具")
+    parser.add_argument("command", choices=["migrate"], help="migrate: 将平铺布局原地迁移为分桶目录")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        print(json.dumps(migrate_flat_layout(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
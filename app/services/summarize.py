@@ -1,4 +1,5 @@
 import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from typing import Optional
 
 from langdetect import detect
@@ -142,3 +143,18 @@ def summarize_text(text: str) -> str:
         return _textrank_zh(text)
     else:
         return _sumy_summary_en(text)
+
+
+# 总结超时（秒）；DeepSeek/OpenAI 请求卡住时避免任务一直挂起
+SUMMARIZE_TIMEOUT = 180
+
+
+def summarize_text_with_timeout(text: str, timeout: float = SUMMARIZE_TIMEOUT) -> str:
+    """带超时保护的 summarize_text；超时抛出 TimeoutError（卡住的线程留在后台自行结束，不再等待）"""
+    ex = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarize")
+    try:
+        return ex.submit(summarize_text, text).result(timeout=timeout)
+    except FuturesTimeoutError:
+        raise TimeoutError(f"summarize timeout ({timeout:g}s)")
+    finally:
+        ex.shutdown(wait=False)
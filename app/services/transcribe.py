@@ -1,26 +1,112 @@
 import os
 import subprocess
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Optional
 
 from faster_whisper import WhisperModel
 
-_model_cache: Optional[WhisperModel] = None
+# 按模型名缓存，草稿模型与升级模型可同时常驻；超出内存预算时按最近最少使用淘汰
+_model_cache: "OrderedDict[str, WhisperModel]" = OrderedDict()
+_model_lock = threading.Lock()
+# 每个模型一把加载锁，避免同一模型被并发重复加载
+_loading_locks: "dict[str, threading.Lock]" = {}
 
+# 进行中的前台转写/总结数量（页面任务与批量导入）；后台升级在其为 0 时才占用 CPU/GPU
+_foreground_count = 0
+_foreground_lock = threading.Lock()
 
-def get_model() -> WhisperModel:
-    global _model_cache
-    if _model_cache is None:
-        model_size = os.getenv("WHISPER_MODEL", "tiny")
-        compute_type = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
-        device = os.getenv("WHISPER_DEVICE", "cpu")
-        try:
-            _model_cache = WhisperModel(model_size, device=device, compute_type=compute_type)
-        except Exception:
-            # 回退策略：CPU 优先 float32；CUDA 优先 float16
-            fallback = "float16" if device == "cuda" else "float32"
-            _model_cache = WhisperModel(model_size, device=device, compute_type=fallback)
-    return _model_cache
+# 各模型大致内存占用（MB），用于内存预算估算；未知模型按 1000MB 计
+_MODEL_MEMORY_MB = {
+    "tiny": 150,
+    "base": 250,
+    "small": 600,
+    "medium": 1500,
+    "large-v1": 3000,
+    "large-v2": 3000,
+    "large-v3": 3000,
+    "large": 3000,
+    "distil-large-v3": 1600,
+    "turbo": 1600,
+}
+
+
+def draft_model_size() -> str:
+    """默认（草稿）转写模型"""
+    return os.getenv("WHISPER_MODEL", "tiny")
+
+
+def upgrade_model_size() -> str:
+    """后台升级转写使用的较大模型；为空表示不启用两遍转写"""
+    return os.getenv("WHISPER_UPGRADE_MODEL", "")
+
+
+@contextmanager
+def foreground_task():
+    """标记前台任务进行中，低优先级转写会暂停等待其结束"""
+    global _foreground_count
+    with _foreground_lock:
+        _foreground_count += 1
+    try:
+        yield
+    finally:
+        with _foreground_lock:
+            _foreground_count -= 1
+
+
+def wait_for_foreground(poll: float = 5) -> None:
+    """阻塞直到没有前台任务（仅统计本进程内的任务）"""
+    while _foreground_count > 0:
+        time.sleep(poll)
+
+
+def _estimate_memory_mb(model_size: str) -> int:
+    name = model_size.split("/")[-1].replace(".en", "")
+    return _MODEL_MEMORY_MB.get(name, 1000)
+
+
+def _load_model(model_size: str) -> WhisperModel:
+    compute_type = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+    device = os.getenv("WHISPER_DEVICE", "cpu")
+    try:
+        return WhisperModel(model_size, device=device, compute_type=compute_type)
+    except Exception:
+        # 回退策略：CPU 优先 float32；CUDA 优先 float16
+        fallback = "float16" if device == "cuda" else "float32"
+        return WhisperModel(model_size, device=device, compute_type=fallback)
+
+
+def get_model(model_size: Optional[str] = None) -> WhisperModel:
+    model_size = model_size or draft_model_size()
+    with _model_lock:
+        if model_size in _model_cache:
+            _model_cache.move_to_end(model_size)
+            return _model_cache[model_size]
+        loading = _loading_locks.setdefault(model_size, threading.Lock())
+
+    # 加载可能耗时数分钟：不持有 _model_lock，已缓存的模型照常可用；
+    # 同一模型只加载一次，其他请求同一模型的线程在 loading 锁上等待
+    with loading:
+        with _model_lock:
+            if model_size in _model_cache:
+                _model_cache.move_to_end(model_size)
+                return _model_cache[model_size]
+            # 加载前先腾出预算：淘汰最久未使用的模型（正在使用中的实例由调用方持有引用，不受影响）
+            budget = int(os.getenv("WHISPER_MEMORY_BUDGET_MB", "4096"))
+            if budget > 0:
+                used = sum(_estimate_memory_mb(k) for k in _model_cache)
+                while _model_cache and used + _estimate_memory_mb(model_size) > budget:
+                    evicted, _ = _model_cache.popitem(last=False)
+                    used -= _estimate_memory_mb(evicted)
+
+        model = _load_model(model_size)
+
+        with _model_lock:
+            _model_cache[model_size] = model
+            return model
 
 
 def _ffmpeg_preprocess(input_path: str, work_dir: str) -> str:
@@ -42,13 +128,28 @@ def _ffmpeg_preprocess(input_path: str, work_dir: str) -> str:
         return input_path
 
 
-def transcribe_audio(file_path: str, work_dir: str = "data/processed") -> str:
+def transcribe_audio(
+    file_path: str,
+    work_dir: str = "data/processed",
+    model_size: Optional[str] = None,
+    low_priority: bool = False,
+) -> str:
+    """
+    转写音频
+
+    low_priority 为 True 时，开始前及每个分段之间都会等待前台任务结束；
+    分段是惰性解码的，暂停迭代即暂停推理
+    """
+    if low_priority:
+        wait_for_foreground()
     processed_path = _ffmpeg_preprocess(file_path, work_dir=work_dir)
-    model = get_model()
+    model = get_model(model_size)
     try:
         segments, info = model.transcribe(processed_path, vad_filter=True)
         text_parts = []
         for segment in segments:
+            if low_priority:
+                wait_for_foreground()
             if segment and segment.text:
                 text_parts.append(segment.text)
         text = " ".join(text_parts).strip()
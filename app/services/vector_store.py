@@ -3,17 +3,22 @@
 """
 import os
 import json
+import threading
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
 
+from app.services.storage import data_file, iter_rids
+
 
 # 配置
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 CHROMA_DB_DIR = BASE_DIR / "chroma_db"
 CHROMA_DB_DIR.mkdir(parents=True, exist_ok=True)
+# 记录自上次压缩以来的删除数量（HNSW 删除只打标记，不回收空间）
+GC_STATE_FILE = CHROMA_DB_DIR / "gc_state.json"
 
 # 使用多语言模型（支持中英文）
 DEFAULT_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
@@ -23,6 +28,9 @@ EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", DEFAULT_MODEL)
 _model_cache: Optional[SentenceTransformer] = None
 _chroma_client_cache: Optional[chromadb.ClientAPI] = None
 
+# 写操作与压缩互斥，避免压缩期间写入的数据丢失
+_write_lock = threading.RLock()
+
 
 def get_embedding_model() -> SentenceTransformer:
     """获取或创建 embedding 模型（单例）"""
@@ -44,7 +52,7 @@ def get_chroma_client() -> chromadb.ClientAPI:
 
 
 def get_collection(collection_name: str = "audio_diary"):
-    """获取或创建集合"""
+    """获取或创建集合（会创建集合，只应在持有写锁时调用）"""
     client = get_chroma_client()
     return client.get_or_create_collection(
         name=collection_name,
@@ -52,6 +60,55 @@ def get_collection(collection_name: str = "audio_diary"):
     )
 
 
+def _existing_collection(collection_name: str):
+    """获取已存在的集合，不存在时返回 None（只读路径使用，不会在压缩替换的间隙建出空集合）"""
+    try:
+        return get_chroma_client().get_collection(name=collection_name)
+    except Exception:
+        return None
+
+
+def _index_metadata(rid: str, metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    只保留可用于 where 过滤的字段，并统一类型：
+    rid/original_filename/state 为字符串，created_at 为整数时间戳
+    """
+    src = metadata or {}
+    meta: Dict[str, Any] = {
+        "rid": rid,
+        "original_filename": str(src.get("original_filename") or ""),
+        "state": str(src.get("state") or "done"),
+    }
+    try:
+        meta["created_at"] = int(src.get("created_at") or 0)
+    except (TypeError, ValueError):
+        meta["created_at"] = 0
+    return meta
+
+
+def build_where(
+    created_from: Optional[int] = None,
+    created_to: Optional[int] = None,
+    original_filename: Optional[str] = None,
+    state: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """把搜索条件转换为 Chroma 的 where 过滤表达式（无条件时返回 None）"""
+    conditions: List[Dict[str, Any]] = []
+    if created_from is not None:
+        conditions.append({"created_at": {"$gte": int(created_from)}})
+    if created_to is not None:
+        conditions.append({"created_at": {"$lte": int(created_to)}})
+    if original_filename:
+        conditions.append({"original_filename": {"$eq": original_filename}})
+    if state:
+        conditions.append({"state": {"$eq": state}})
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+
 def add_document(
     rid: str,
     text: str,
@@ -64,34 +121,45 @@ def add_document(
     Args:
         rid: 记录ID
         text: 文本内容（转写文本或总结）
-        metadata: 元数据（文件名、创建时间等）
+        metadata: 元数据（文件名、创建时间、任务状态）
         collection_name: 集合名称
     """
     if not text or not text.strip():
         return
     
     model = get_embedding_model()
-    collection = get_collection(collection_name)
     
     # 生成 embedding
     embedding = model.encode(text, convert_to_numpy=True).tolist()
     
-    # 准备元数据
-    meta = metadata or {}
-    meta["rid"] = rid
+    # 准备元数据（类型固定，便于 where 过滤）
+    meta = _index_metadata(rid, metadata)
     
     # Chroma 使用 upsert 自动处理新增或更新
-    collection.upsert(
-        ids=[rid],
-        embeddings=[embedding],
-        documents=[text],
-        metadatas=[meta]
-    )
+    with _write_lock:
+        collection = get_collection(collection_name)
+        collection.upsert(
+            ids=[rid],
+            embeddings=[embedding],
+            documents=[text],
+            metadatas=[meta]
+        )
+
+
+def update_document_state(rid: str, state: str, collection_name: str = "audio_diary"):
+    """同步记录的任务状态到索引元数据（记录未入库时忽略）"""
+    with _write_lock:
+        collection = get_collection(collection_name)
+        if not collection.get(ids=[rid], include=[])["ids"]:
+            return
+        collection.update(ids=[rid], metadatas=[{"state": state}])
 
 
 def search_documents(
     query: str,
     n_results: int = 10,
+    offset: int = 0,
+    where: Optional[Dict[str, Any]] = None,
     collection_name: str = "audio_diary"
 ) -> List[Dict[str, Any]]:
     """
@@ -99,7 +167,9 @@ def search_documents(
     
     Args:
         query: 搜索查询
-        n_results: 返回结果数量
+        n_results: 返回结果数量（每页条数）
+        offset: 跳过的结果数量（分页）
+        where: 元数据过滤条件（见 build_where），由向量库在检索时直接过滤
         collection_name: 集合名称
     
     Returns:
@@ -109,21 +179,29 @@ def search_documents(
         return []
     
     model = get_embedding_model()
-    collection = get_collection(collection_name)
+    collection = _existing_collection(collection_name)
+    if collection is None:
+        return []
     
     # 生成查询 embedding
     query_embedding = model.encode(query, convert_to_numpy=True).tolist()
     
-    # 执行搜索
+    # 执行搜索；Chroma 不支持 offset，取前 offset + n_results 条后切片
+    kwargs: Dict[str, Any] = {}
+    if where:
+        kwargs["where"] = where
     results = collection.query(
         query_embeddings=[query_embedding],
-        n_results=n_results
+        n_results=offset + n_results,
+        **kwargs
     )
     
     # 格式化结果
     formatted_results = []
     if results and results.get("ids") and results["ids"][0]:
         for i, rid in enumerate(results["ids"][0]):
+            if i < offset:
+                continue
             formatted_results.append({
                 "rid": rid,
                 "text": results["documents"][0][i] if results.get("documents") else "",
@@ -142,24 +220,149 @@ def delete_document(rid: str, collection_name: str = "audio_diary"):
         rid: 记录ID
         collection_name: 集合名称
     """
-    collection = get_collection(collection_name)
-    try:
-        collection.delete(ids=[rid])
-    except Exception:
-        pass  # 如果不存在则忽略
+    delete_documents([rid], collection_name)
 
 
-def rebuild_index(
-    data_dir: Path,
-    upload_dir: Path,
-    collection_name: str = "audio_diary"
-) -> Dict[str, int]:
+def delete_documents(rids: List[str], collection_name: str = "audio_diary") -> int:
+    """
+    批量删除文档，并累计删除计数（用于判断是否需要压缩）
+    
+    Returns:
+        实际删除的数量
+    """
+    if not rids:
+        return 0
+    with _write_lock:
+        collection = get_collection(collection_name)
+        try:
+            existing = collection.get(ids=list(rids), include=[])["ids"]
+            if not existing:
+                return 0
+            collection.delete(ids=existing)
+        except Exception:
+            return 0  # 如果不存在则忽略
+        state = _read_gc_state()
+        state["deleted_since_compaction"] = state.get("deleted_since_compaction", 0) + len(existing)
+        _write_gc_state(state)
+        return len(existing)
+
+
+def list_document_ids(collection_name: str = "audio_diary", batch_size: int = 1000) -> List[str]:
+    """分批读取集合中的全部文档 ID"""
+    collection = _existing_collection(collection_name)
+    ids: List[str] = []
+    if collection is None:
+        return ids
+    offset = 0
+    while True:
+        batch = collection.get(limit=batch_size, offset=offset, include=[])["ids"]
+        if not batch:
+            break
+        ids.extend(batch)
+        offset += len(batch)
+    return ids
+
+
+def _read_gc_state() -> Dict[str, Any]:
+    if GC_STATE_FILE.exists():
+        try:
+            return json.loads(GC_STATE_FILE.read_text(encoding="utf-8"))
+        except Exception:
+            pass
+    return {"deleted_since_compaction": 0}
+
+
+def _write_gc_state(state: Dict[str, Any]) -> None:
+    GC_STATE_FILE.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def deleted_since_compaction() -> int:
+    return int(_read_gc_state().get("deleted_since_compaction", 0))
+
+
+def compact_collection(collection_name: str = "audio_diary", batch_size: int = 500) -> Dict[str, int]:
+    """
+    压缩集合：把现存文档复制到新集合后替换旧集合，丢弃 HNSW 中已删除条目占用的空间
+    
+    复制与替换期间持有写锁；只读路径不会创建集合，替换间隙的查询返回空结果。
+    替换中途中断时，残留的 `{name}__compact` 由 recover_compaction 接管。
+    
+    Returns:
+        统计信息：{"entries": 保留的条目数, "bytes_before": 压缩前目录大小, "bytes_after": 压缩后目录大小}
+    """
+    client = get_chroma_client()
+    tmp_name = f"{collection_name}__compact"
+    bytes_before = _dir_size(CHROMA_DB_DIR)
+    entries = 0
+
+    with _write_lock:
+        recover_compaction(collection_name)
+        old = get_collection(collection_name)
+        new = client.create_collection(name=tmp_name, metadata={"hnsw:space": "cosine"})
+
+        offset = 0
+        while True:
+            batch = old.get(
+                limit=batch_size,
+                offset=offset,
+                include=["embeddings", "documents", "metadatas"],
+            )
+            if not batch["ids"]:
+                break
+            new.add(
+                ids=batch["ids"],
+                embeddings=batch["embeddings"],
+                documents=batch["documents"],
+                metadatas=batch["metadatas"],
+            )
+            entries += len(batch["ids"])
+            offset += len(batch["ids"])
+
+        client.delete_collection(collection_name)
+        new.modify(name=collection_name)
+
+        state = _read_gc_state()
+        state["deleted_since_compaction"] = 0
+        _write_gc_state(state)
+
+    return {"entries": entries, "bytes_before": bytes_before, "bytes_after": _dir_size(CHROMA_DB_DIR)}
+
+
+def recover_compaction(collection_name: str = "audio_diary") -> Optional[str]:
+    """
+    处理上次压缩中断后残留的 `{name}__compact` 集合（服务启动时及每次压缩前调用）
+
+    - 原集合已被删除（或只剩替换间隙里新建的空集合）：把副本改名为原集合
+    - 原集合完好：副本是未完成的复制，直接丢弃
+
+    Returns:
+        "restored" / "discarded"；没有残留时返回 None
+    """
+    client = get_chroma_client()
+    tmp_name = f"{collection_name}__compact"
+    with _write_lock:
+        tmp = _existing_collection(tmp_name)
+        if tmp is None:
+            return None
+        current = _existing_collection(collection_name)
+        if current is not None and (current.count() > 0 or tmp.count() == 0):
+            client.delete_collection(tmp_name)
+            return "discarded"
+        if current is not None:
+            client.delete_collection(collection_name)
+        tmp.modify(name=collection_name)
+        return "restored"
+
+
+def _dir_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def rebuild_index(collection_name: str = "audio_diary") -> Dict[str, int]:
     """
     重建索引：扫描所有现有的转写文本和总结，批量建立索引
     
     Args:
-        data_dir: 数据目录（存放 .txt 和 .summary.txt）
-        upload_dir: 上传目录（存放音频文件）
         collection_name: 集合名称
     
     Returns:
@@ -168,15 +371,9 @@ def rebuild_index(
     indexed = 0
     skipped = 0
     
-    # 收集所有记录ID
-    rids = set()
-    for item in upload_dir.iterdir():
-        if item.is_file() and not item.name.endswith('.proc.wav'):
-            rids.add(item.stem)
-    
-    for rid in rids:
-        transcript_file = data_dir / f"{rid}.txt"
-        summary_file = data_dir / f"{rid}.summary.txt"
+    for rid in iter_rids():
+        transcript_file = data_file(rid, ".txt")
+        summary_file = data_file(rid, ".summary.txt")
         
         # 优先使用总结，其次使用转写文本
         text = ""
@@ -189,14 +386,16 @@ def rebuild_index(
             skipped += 1
             continue
         
-        # 读取元数据
-        meta_file = data_dir / f"{rid}.meta.json"
+        # 读取元数据与任务状态
         metadata = {}
-        if meta_file.exists():
-            try:
-                metadata = json.loads(meta_file.read_text(encoding="utf-8"))
-            except Exception:
-                pass
+        for suffix in (".meta.json", ".status.json"):
+            f = data_file(rid, suffix)
+            if f.exists():
+                try:
+                    loaded = json.loads(f.read_text(encoding="utf-8"))
+                    metadata.update(loaded if suffix == ".meta.json" else {"state": loaded.get("state")})
+                except Exception:
+                    pass
         
         # 添加到索引
         try:
@@ -0,0 +1,191 @@
+"""
+独立转写 worker：从服务端领取任务，下载音频，本地转写/总结后把结果上传回服务端
+
+用法（服务端需以 TASK_BACKEND=remote 启动）：
+    python -m app.worker --server http://127.0.0.1:8000
+
+同一台或多台机器上可以同时运行多个 worker 进程。
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+class LeaseLost(Exception):
+    """租约已过期或任务被重新投递，当前结果不再被接受"""
+
+
+class WorkerClient:
+    """worker 侧的 HTTP 客户端（仅依赖标准库）"""
+
+    def __init__(self, server: str, worker_id: str, token: str = "", ttl: int = 120):
+        self.server = server.rstrip("/")
+        self.worker_id = worker_id
+        self.token = token
+        self.ttl = ttl
+
+    def _request(self, method: str, path: str, data: Optional[Dict[str, Any]] = None, timeout: int = 60):
+        body = None
+        headers = {}
+        if data is not None:
+            body = urllib.parse.urlencode({k: v for k, v in data.items() if v is not None}).encode("utf-8")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self.token:
+            headers["X-Worker-Token"] = self.token
+        req = urllib.request.Request(self.server + path, data=body, headers=headers, method=method)
+        try:
+            return urllib.request.urlopen(req, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 410:
+                raise LeaseLost(path)
+            raise
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        with self._request("POST", "/worker/lease", {"worker_id": self.worker_id, "ttl": self.ttl}) as resp:
+            if resp.status == 204:
+                return None
+            return json.loads(resp.read().decode("utf-8"))
+
+    def heartbeat(self, lease_id: str, state: Optional[str] = None) -> None:
+        with self._request("POST", f"/worker/lease/{lease_id}/heartbeat", {"state": state, "ttl": self.ttl}):
+            pass
+
+    def download_audio(self, lease: Dict[str, Any], target: Path) -> None:
+        with self._request("GET", lease["audio_url"], timeout=600) as resp, open(target, "wb") as f:
+            shutil.copyfileobj(resp, f, 1024 * 1024)
+
+    def complete(self, lease_id: str, transcript: Optional[str], summary: Optional[str]) -> None:
+        with self._request("POST", f"/worker/lease/{lease_id}/complete", {"transcript": transcript, "summary": summary}):
+            pass
+
+    def fail(self, lease_id: str, error: str) -> None:
+        with self._request("POST", f"/worker/lease/{lease_id}/fail", {"error": error}):
+            pass
+
+
+class _Heartbeat(threading.Thread):
+    """后台续约线程；state 字段由主线程更新，随下一次心跳上报"""
+
+    def __init__(self, client: WorkerClient, lease_id: str):
+        super().__init__(daemon=True)
+        self.client = client
+        self.lease_id = lease_id
+        self.state: Optional[str] = None
+        self.lost = False
+        self._stop_event = threading.Event()
+
+    def run(self):
+        interval = max(1, self.client.ttl // 3)
+        while not self._stop_event.wait(interval):
+            try:
+                self.client.heartbeat(self.lease_id, self.state)
+            except LeaseLost:
+                self.lost = True
+                return
+            except Exception:
+                pass  # 网络抖动时下次再试，直到租约真正过期
+
+    def beat(self, state: str):
+        self.state = state
+        try:
+            self.client.heartbeat(self.lease_id, state)
+        except LeaseLost:
+            self.lost = True
+        except Exception:
+            pass
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def process_lease(client: WorkerClient, lease: Dict[str, Any]) -> None:
+    from app.services.transcribe import transcribe_audio
+    from app.services.summarize import summarize_text_with_timeout
+
+    mode = lease["mode"]
+    heartbeat = _Heartbeat(client, lease["lease_id"])
+    heartbeat.start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="audio-diary-worker-") as tmp:
+            transcript: str = lease.get("transcript") or ""
+            summary: Optional[str] = None
+
+            if mode in ("transcribe", "all"):
+                audio_path = Path(tmp) / lease["audio_filename"]
+                client.download_audio(lease, audio_path)
+                heartbeat.beat("transcribing")
+                transcript = transcribe_audio(str(audio_path), work_dir=tmp)
+
+            if mode in ("summarize", "all"):
+                heartbeat.beat("summarizing")
+                # 心跳会一直续约，总结卡住时必须自行超时，否则任务永远不会被回收
+                try:
+                    summary = summarize_text_with_timeout(transcript)
+                except TimeoutError as e:
+                    raise RuntimeError(f"summarize_timeout: {e}")
+
+            if heartbeat.lost:
+                raise LeaseLost(lease["lease_id"])
+            client.complete(
+                lease["lease_id"],
+                transcript if mode in ("transcribe", "all") else None,
+                summary,
+            )
+    except LeaseLost:
+        print(f"[worker {client.worker_id}] lease lost: {lease['rid']}", flush=True)
+    except Exception as e:
+        try:
+            client.fail(lease["lease_id"], str(e))
+        except Exception:
+            pass
+        print(f"[worker {client.worker_id}] failed: {lease['rid']}: {e}", flush=True)
+    finally:
+        heartbeat.stop()
+
+
+def run_worker(client: WorkerClient, poll_interval: float = 5.0, once: bool = False) -> None:
+    while True:
+        try:
+            lease = client.claim()
+        except LeaseLost:
+            lease = None
+        except Exception as e:
+            print(f"[worker {client.worker_id}] claim failed: {e}", flush=True)
+            lease = None
+
+        if lease is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        print(f"[worker {client.worker_id}] leased {lease['rid']} ({lease['mode']})", flush=True)
+        process_lease(client, lease)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Audio Diary 转写 worker")
+    parser.add_argument("--server", default=os.getenv("WORKER_SERVER", "http://127.0.0.1:8000"))
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}")
+    parser.add_argument("--token", default=os.getenv("WORKER_TOKEN", ""))
+    parser.add_argument("--ttl", type=int, default=int(os.getenv("WORKER_LEASE_TTL", "120")))
+    parser.add_argument("--poll", type=float, default=5.0, help="队列为空时的轮询间隔（秒）")
+    parser.add_argument("--once", action="store_true", help="队列为空时退出（便于脚本/测试）")
+    args = parser.parse_args(argv)
+
+    client = WorkerClient(args.server, args.worker_id, token=args.token, ttl=args.ttl)
+    run_worker(client, poll_interval=args.poll, once=args.once)
+
+
+if __name__ == "__main__":
+    main()